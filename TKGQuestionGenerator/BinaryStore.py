@@ -0,0 +1,292 @@
+import json
+import mmap
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from TKGQuestionGenerator.FactTable import FactTable
+
+MAGIC = b'TKGQSTR1'
+ALIGNMENT = 8
+OFFSET_DTYPE = np.dtype('<i8')
+
+ARRAY = 'array'
+STRINGS = 'strings'
+
+
+def write_store(path, columns, attributes=None):
+    """
+    Writes a binary store that can be opened zero-copy with BinaryStore.
+
+    File layout:
+    - 8 bytes magic, 8 bytes little endian header length, JSON header
+    - every column aligned to 8 bytes. Numeric columns are stored as fixed-width little endian arrays.
+      String columns are stored as a heap: n + 1 int64 offsets followed by the utf-8 encoded bytes.
+
+    The file is written to a temporary path first and then renamed, so readers never see a partial store.
+
+    :param path: path of the store
+    :param columns: dict column name -> numpy array or list of strings. Columns may have different lengths.
+    :param attributes: Optional JSON serialisable dict stored in the header
+    """
+    layout = {}
+    blobs = []
+    position = 0
+
+    for name, values in columns.items():
+        if isinstance(values, np.ndarray) and values.dtype != object:
+            array = np.ascontiguousarray(values, dtype=values.dtype.newbyteorder('<'))
+            layout[name] = {'kind': ARRAY, 'dtype': array.dtype.str, 'length': len(array), 'offset': position}
+            position = append_blob(blobs, array.tobytes(), position)
+        else:
+            encoded = [str(value).encode('utf-8') for value in values]
+            offsets = np.zeros(len(encoded) + 1, dtype=OFFSET_DTYPE)
+            np.cumsum([len(value) for value in encoded], out=offsets[1:])
+            layout[name] = {'kind': STRINGS, 'length': len(encoded), 'offset': position}
+            position = append_blob(blobs, offsets.tobytes(), position)
+            layout[name]['data'] = position
+            position = append_blob(blobs, b''.join(encoded), position)
+
+    header = json.dumps({'columns': layout, 'attributes': attributes or {}}).encode('utf-8')
+    data_start = align(len(MAGIC) + 8 + len(header))
+
+    # unique across machines sharing a directory, unlike the process id
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(header)
+        f.write(b'\0' * (data_start - f.tell()))
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, path)
+
+
+def append_blob(blobs, blob, position):
+    padding = align(len(blob)) - len(blob)
+    blobs.append(blob + b'\0' * padding)
+    return position + len(blob) + padding
+
+
+def align(position):
+    return (position + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class BinaryStore:
+    """
+    Read only, memory-mapped view of a store written by write_store.
+
+    Numeric columns are returned as numpy arrays backed by the mapping, so several processes opening the same
+    file share the pages of the OS page cache instead of holding their own copies.
+    Pickling a BinaryStore only transfers its path, the receiving process maps the file again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a binary store')
+        header_length = int.from_bytes(self._mmap[len(MAGIC):len(MAGIC) + 8], 'little')
+        header_start = len(MAGIC) + 8
+        header = json.loads(self._mmap[header_start:header_start + header_length].decode('utf-8'))
+
+        self.columns = header['columns']
+        self.attributes = header['attributes']
+        self._data_start = align(header_start + header_length)
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+    def __len__(self):
+        return max((column['length'] for column in self.columns.values()), default=0)
+
+    def array(self, name, start=0, stop=None):
+        """
+        :return: zero-copy numpy view of a numeric column or of a slice of it
+        """
+        column = self.columns[name]
+        if column['kind'] != ARRAY:
+            raise ValueError(f'{name} is not a numeric column')
+        start, stop, _ = slice(start, stop).indices(column['length'])
+        dtype = np.dtype(column['dtype'])
+        return np.frombuffer(self._mmap, dtype=dtype, count=max(stop - start, 0),
+                             offset=self._data_start + column['offset'] + start * dtype.itemsize)
+
+    def string_column(self, name):
+        return StringColumn(self, name)
+
+    def strings(self, name, start=0, stop=None):
+        """
+        Decodes a slice of a string column. Only the bytes of the requested rows are touched.
+        """
+        column = self.columns[name]
+        if column['kind'] != STRINGS:
+            raise ValueError(f'{name} is not a string column')
+        start, stop, _ = slice(start, stop).indices(column['length'])
+        if stop <= start:
+            return []
+        offsets = np.frombuffer(self._mmap, dtype=OFFSET_DTYPE, count=stop - start + 1,
+                                offset=self._data_start + column['offset'] + start * OFFSET_DTYPE.itemsize)
+        data = self._data_start + column['data']
+        return [self._mmap[data + offsets[i]:data + offsets[i + 1]].decode('utf-8')
+                for i in range(stop - start)]
+
+    def string(self, name, row):
+        return self.strings(name, row, row + 1)[0]
+
+
+class StringColumn:
+    """
+    List like, lazily decoding access to a string column. Used as vocabulary of memory-mapped FactTables.
+    """
+
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+
+    def __len__(self):
+        return self.store.columns[self.name]['length']
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            start, stop, step = row.indices(len(self))
+            return self.store.strings(self.name, start, stop)[::step]
+        if row < 0:
+            row += len(self)
+        return self.store.string(self.name, row)
+
+    def __iter__(self):
+        return iter(self.store.strings(self.name))
+
+    def index(self, value):
+        for i, entry in enumerate(self):
+            if entry == value:
+                return i
+        raise ValueError(f'{value} is not in {self.name}')
+
+
+####################### Fact Store #######################
+
+def save_fact_table(fact_table, path):
+    """
+    Persists a FactTable as binary store.
+    """
+    write_store(path, {'subject': fact_table.subject,
+                       'predicate': fact_table.predicate,
+                       'object': fact_table.object,
+                       'from': fact_table.time_from,
+                       'until': fact_table.time_until,
+                       'index': fact_table.index,
+                       'entities': list(fact_table.entities),
+                       'predicates': list(fact_table.predicates)},
+                attributes={'type': 'facts'})
+
+
+def load_fact_table(path_or_store, start=0, stop=None):
+    """
+    Opens a fact store as FactTable without deserialising it.
+    The code arrays are memory-mapped views and the vocabularies are decoded lazily.
+
+    :param path_or_store: path of a store written by save_fact_table or an opened BinaryStore
+    :param start: first positional row
+    :param stop: positional row after the last row, None for all rows
+    :return: FactTable
+    """
+    store = path_or_store
+    if not isinstance(store, BinaryStore):
+        store = BinaryStore(path_or_store)
+    return FactTable(store.array('subject', start, stop),
+                     store.array('predicate', start, stop),
+                     store.array('object', start, stop),
+                     store.array('from', start, stop),
+                     store.array('until', start, stop),
+                     store.string_column('entities'),
+                     store.string_column('predicates'),
+                     index=store.array('index', start, stop))
+
+
+####################### Question Store #######################
+
+def save_questions(df, question_type, path, *, attributes=None):
+    """
+    Persists generated (and optionally answered) questions of one question type as binary store.
+
+    Expects the layout of Generator.generate_questions. {question_type}_model_an, {question_type}_time and
+    {question_type}_confidence are stored as well if they are present. Answers are stored JSON encoded, predicates
+    are interned. Missing model answers, e.g. of questions cancelled by Inference.answer_yes_no_robust_adaptive, are
+    stored in a null mask and read as NaN again.
+
+    :param df: DataFrame of questions
+    :param question_type: question type of the DataFrame
+    :param path: path of the store
+    :param attributes: Optional JSON serialisable dict stored in the header besides type and question_type
+    """
+    predicate_codes, predicates = pd.factorize(df['predicate'])
+    columns = {'qe': df[f'{question_type}_qe'].tolist(),
+               'an': [json.dumps(answer, default=int) for answer in df[f'{question_type}_an']],
+               'predicate': predicate_codes.astype(np.int32),
+               'predicates': predicates.tolist(),
+               'qe_index': df['qe_index'].to_numpy(dtype=np.int64)}
+    if f'{question_type}_model_an' in df:
+        model_an = df[f'{question_type}_model_an']
+        columns['model_an'] = model_an.fillna('').tolist()
+        columns['model_an_missing'] = model_an.isna().to_numpy(dtype=np.uint8)
+    if f'{question_type}_time' in df:
+        columns['time'] = df[f'{question_type}_time'].to_numpy(dtype=np.float64)
+    if f'{question_type}_confidence' in df:
+        columns['confidence'] = df[f'{question_type}_confidence'].to_numpy(dtype=np.float64)
+
+    write_store(path, columns, attributes={**(attributes or {}), 'type': 'questions', 'question_type': question_type})
+
+
+def read_questions(path_or_store, start=0, stop=None):
+    """
+    Reads a slice of a question store into the DataFrame layout the evaluation functions expect.
+
+    :param path_or_store: path of a store written by save_questions or an opened BinaryStore
+    :param start: first row
+    :param stop: row after the last row, None for all rows
+    :return: DataFrame with {question_type}_qe, {question_type}_an, predicate, qe_index
+    and, if stored, {question_type}_model_an, {question_type}_time and {question_type}_confidence
+    """
+    if not isinstance(path_or_store, BinaryStore):
+        with BinaryStore(path_or_store) as store:
+            return read_questions(store, start, stop)
+
+    store = path_or_store
+    question_type = store.attributes['question_type']
+    start, stop, _ = slice(start, stop).indices(len(store.string_column('qe')))
+
+    predicates = store.string_column('predicates')[:]
+    df = pd.DataFrame({f'{question_type}_qe': store.strings('qe', start, stop),
+                       f'{question_type}_an': [json.loads(an) for an in store.strings('an', start, stop)],
+                       'predicate': [predicates[code] for code in store.array('predicate', start, stop)],
+                       'qe_index': store.array('qe_index', start, stop).copy()},
+                      index=pd.RangeIndex(start, stop))
+    if 'model_an' in store.columns:
+        df[f'{question_type}_model_an'] = store.strings('model_an', start, stop)
+        if 'model_an_missing' in store.columns:
+            missing = store.array('model_an_missing', start, stop).astype(bool)
+            df.loc[missing, f'{question_type}_model_an'] = np.nan
+    if 'time' in store.columns:
+        df[f'{question_type}_time'] = store.array('time', start, stop).copy()
+    if 'confidence' in store.columns:
+        df[f'{question_type}_confidence'] = store.array('confidence', start, stop).copy()
+    return df
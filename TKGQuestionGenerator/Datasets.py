@@ -0,0 +1,235 @@
+import hashlib
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+import TKGQuestionGenerator.BinaryStore as store
+import TKGQuestionGenerator.FactTable as ft
+
+# bump if the normalisation changes, so cached fact stores are rebuilt
+ADAPTER_VERSION = 1
+
+CACHE_EXTENSION = '.facts'
+# default directory of the cached fact stores, outside of the data directories of the repository
+DEFAULT_CACHE_DIR = os.environ.get('TKGQG_CACHE_DIR',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'TKGQuestionGenerator'))
+
+# Layout of the upstream files: tab separated without header.
+# - YAGO11k and Wikidata12k (HyTE): subject, predicate, object, start date, end date with unknown parts as ####
+# - ICEWS14 and ICEWS05-15: subject, predicate, object, date of the event
+# - CronKGQA (full.txt): Wikidata ids of subject, predicate and object, start year, end year
+DATASETS = {'YAGO11k': {'columns': ft.FACT_COLUMNS, 'yago_names': True},
+            'Wikidata12k': {'columns': ft.FACT_COLUMNS},
+            'ICEWS14': {'columns': [ft.SUBJECT, ft.PREDICATE, ft.OBJECT, ft.FROM]},
+            'ICEWS05-15': {'columns': [ft.SUBJECT, ft.PREDICATE, ft.OBJECT, ft.FROM]},
+            'CronKGQA': {'columns': ft.FACT_COLUMNS}}
+
+# files of the showcase_data directory which are already normalised to the fact schema
+SHOWCASE_FILES = {'YAGO11k': 'YAGO11k.csv',
+                  'Wikidata12k': 'wikidata12k.csv',
+                  'ICEWS14': 'icews14.csv',
+                  'ICEWS05-15': 'icews05-15.csv',
+                  'CronKGQA': 'CronKGQA.csv'}
+
+CAMEL_CASE_BOUNDARY = re.compile(r'(?<=[a-z0-9])(?=[A-Z])')
+
+
+def is_normalised_csv(path):
+    """
+    :return: True if the file is a CSV with a header containing the fact columns such as showcase_data/YAGO11k.csv
+    """
+    if not path.endswith('.csv'):
+        return False
+    header = pd.read_csv(path, nrows=0).columns
+    return all(column in header for column in ft.FACT_COLUMNS)
+
+
+def read_chunks(dataset, path, *, chunksize=100_000):
+    """
+    Streams a source file in chunks normalised to the fact schema.
+
+    Subject and object are read as strings, the predicate as categorical and the time columns as strings that are
+    parsed into years by FactTable.from_dataframe.
+
+    :param dataset: key of DATASETS
+    :param path: upstream file or normalised CSV
+    :param chunksize: number of rows read at once
+    :return: iterator of DataFrames with the columns subject, predicate, object, from and until
+    """
+    if dataset not in DATASETS:
+        raise ValueError(f'Unknown dataset {dataset}, expected one of {", ".join(DATASETS)}')
+    spec = DATASETS[dataset]
+    dtype = {ft.SUBJECT: str, ft.PREDICATE: 'category', ft.OBJECT: str, ft.FROM: str, ft.UNTIL: str}
+
+    if is_normalised_csv(path):
+        index_col = pd.read_csv(path, nrows=0).columns[0]
+        chunks = pd.read_csv(path, usecols=[index_col, *ft.FACT_COLUMNS], index_col=index_col, dtype=dtype,
+                             chunksize=chunksize, keep_default_na=False)
+        yield from chunks
+        return
+
+    chunks = pd.read_csv(path, sep='\t', header=None, names=spec['columns'], usecols=range(len(spec['columns'])),
+                         dtype=dtype, chunksize=chunksize, keep_default_na=False, quoting=3)
+    for chunk in chunks:
+        if ft.UNTIL not in chunk:
+            chunk[ft.UNTIL] = chunk[ft.FROM]
+        if spec.get('yago_names'):
+            chunk = normalise_yago_names(chunk)
+        yield chunk[ft.FACT_COLUMNS]
+
+
+def normalise_yago_names(chunk):
+    """
+    Converts the names of the upstream YAGO11k files into the format of data/YAGO11k.csv,
+    e.g. <Beverly_Adams> -> Beverly Adams and <wasBornIn> -> was born in.
+    """
+    chunk = chunk.copy()
+    for column in [ft.SUBJECT, ft.OBJECT]:
+        chunk[column] = chunk[column].str.strip('<>').str.replace('_', ' ', regex=False)
+    chunk[ft.PREDICATE] = chunk[ft.PREDICATE].cat.rename_categories(
+        lambda predicate: CAMEL_CASE_BOUNDARY.sub(' ', predicate.strip('<>')).lower())
+    return chunk
+
+
+def read_labels(path):
+    """
+    Reads a tab separated id -> label file such as wd_id2entity_text.txt of CronKGQA.
+
+    :return: dict id -> label
+    """
+    labels = pd.read_csv(path, sep='\t', header=None, names=['id', 'label'], dtype=str, keep_default_na=False,
+                         quoting=3)
+    return dict(zip(labels['id'], labels['label']))
+
+
+def load_source(dataset, path, *, chunksize=100_000, entity_labels=None, predicate_labels=None):
+    """
+    Reads a source into a FactTable chunk by chunk. Only the interned codes of the previous chunks are kept.
+
+    :param entity_labels: Optional label file mapping entity ids onto names, e.g. wd_id2entity_text.txt of CronKGQA
+    :param predicate_labels: Optional label file mapping predicate ids onto names, e.g. wd_id2relation_text.txt
+    :return: FactTable
+    """
+    interner = ft.Interner()
+    tables = [ft.from_dataframe(chunk, interner=interner)
+              for chunk in read_chunks(dataset, path, chunksize=chunksize)]
+    fact_table = ft.concat_fact_tables(tables, interner)
+
+    # labels are applied to the vocabularies only, so every distinct id is looked up once
+    if entity_labels is not None:
+        labels = read_labels(entity_labels)
+        fact_table.entities = [labels.get(value, value) for value in fact_table.entities]
+    if predicate_labels is not None:
+        labels = read_labels(predicate_labels)
+        fact_table.predicates = [labels.get(value, value) for value in fact_table.predicates]
+    return fact_table
+
+
+def source_fingerprint(dataset, path, **kwargs):
+    """
+    :param kwargs: label files the source is read with such as entity_labels, None if not used
+    :return: fingerprint of a source file and the label files it is read with, which changes if one of the files is
+    edited
+    """
+    values = [ADAPTER_VERSION, dataset, *file_signature(path)]
+    for key, value in sorted(kwargs.items()):
+        values.append(key)
+        values.extend(file_signature(value) if value is not None else [None])
+    digest = hashlib.blake2b(digest_size=8)
+    for value in values:
+        digest.update(str(value).encode('utf-8'))
+        digest.update(b'\x1f')
+    return digest.hexdigest()
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+def cache_prefix(path):
+    """
+    :return: file name prefix of the caches of a source, unique per absolute path of the source
+    """
+    path_digest = hashlib.blake2b(os.path.abspath(path).encode('utf-8'), digest_size=4).hexdigest()
+    return f'{os.path.basename(path)}.{path_digest}.'
+
+
+def remove_stale_caches(cache_dir, path, cache_path):
+    """
+    Removes the caches of earlier versions of a source (or of other options) except cache_path.
+    """
+    prefix = cache_prefix(path)
+    for name in os.listdir(cache_dir):
+        if name.startswith(prefix) and name.endswith(CACHE_EXTENSION) and name != os.path.basename(cache_path):
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except FileNotFoundError:
+                pass
+
+
+def load_dataset(dataset, path, *, cache_dir=None, chunksize=100_000, entity_labels=None, predicate_labels=None):
+    """
+    Loads a dataset as FactTable. The normalised facts are cached as fact store (see BinaryStore.save_fact_table),
+    so the second load only memory-maps the cache. The cache is rebuilt if the source file changed, the cache of
+    the previous version is then removed.
+
+    :param dataset: key of DATASETS
+    :param path: upstream file or normalised CSV
+    :param cache_dir: directory of the cache, defaults to DEFAULT_CACHE_DIR (environment variable TKGQG_CACHE_DIR),
+    False disables caching
+    :return: FactTable
+    """
+    kwargs = {'entity_labels': entity_labels, 'predicate_labels': predicate_labels}
+    if cache_dir is False:
+        return load_source(dataset, path, chunksize=chunksize, **kwargs)
+
+    cache_dir = cache_dir or DEFAULT_CACHE_DIR
+    fingerprint = source_fingerprint(dataset, path, **kwargs)
+    cache_path = os.path.join(cache_dir, f'{cache_prefix(path)}{fingerprint}{CACHE_EXTENSION}')
+    if not os.path.exists(cache_path):
+        os.makedirs(cache_dir, exist_ok=True)
+        store.save_fact_table(load_source(dataset, path, chunksize=chunksize, **kwargs), cache_path)
+        remove_stale_caches(cache_dir, path, cache_path)
+    return store.load_fact_table(cache_path)
+
+
+def load_showcase(directory, datasets=None, *, cache_dir=None):
+    """
+    Loads the normalised showcase files (see showcase_data) and combines them into one FactTable,
+    the replacement of reading every CSV and concatenating them with pd.concat. The indices of the datasets are
+    offset, see combine_fact_tables.
+
+    :param directory: directory of the showcase files
+    :param datasets: Optional keys of SHOWCASE_FILES, None for all datasets
+    :return: FactTable
+    """
+    datasets = datasets or list(SHOWCASE_FILES)
+    return combine_fact_tables([load_dataset(dataset, os.path.join(directory, SHOWCASE_FILES[dataset]),
+                                             cache_dir=cache_dir)
+                                for dataset in datasets])
+
+
+def combine_fact_tables(tables):
+    """
+    Concatenates FactTables with different vocabularies. Only the vocabularies are re-interned,
+    the codes are remapped with one lookup per column.
+
+    The index of every table is offset by the end of the index of the previous tables, so the indices (the qe_index
+    of the generated questions) stay unique across the sources.
+    """
+    interner = ft.Interner()
+    recoded = []
+    offset = 0
+    for table in tables:
+        entity_codes = interner.intern_entities(list(table.entities))
+        predicate_codes = interner.intern_predicates(list(table.predicates))
+        index = np.asarray(table.index, dtype=np.int64) + offset
+        offset = int(index.max(initial=offset - 1)) + 1
+        recoded.append(ft.FactTable(entity_codes[table.subject], predicate_codes[table.predicate],
+                                    entity_codes[table.object], np.asarray(table.time_from),
+                                    np.asarray(table.time_until), None, None,
+                                    index=index.astype(ft.smallest_int_dtype(offset))))
+    return ft.concat_fact_tables(recoded, interner)
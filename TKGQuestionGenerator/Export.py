@@ -0,0 +1,226 @@
+import bisect
+import gzip
+import hashlib
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MANIFEST_NAME = 'manifest.json'
+GZIP = 'gzip'
+ZSTD = 'zstd'
+EXTENSIONS = {GZIP: 'jsonl.gz', ZSTD: 'jsonl.zst'}
+
+
+def to_json_value(value):
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, (range, np.ndarray)):
+        return list(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serialisable')
+
+
+def question_records(question_dfs):
+    """
+    Converts generated questions into export records.
+
+    :param question_dfs: dict question type -> DataFrame in the layout of Generator.generate_questions
+    :return: iterator of dicts with question, answer, question_type, predicate and qe_index
+    """
+    for question_type, df in question_dfs.items():
+        for question, answer, predicate, qe_index in zip(df[f'{question_type}_qe'], df[f'{question_type}_an'],
+                                                         df['predicate'], df['qe_index']):
+            yield {'question': question, 'answer': answer, 'question_type': question_type,
+                   'predicate': predicate, 'qe_index': qe_index}
+
+
+def template_records(temps, question_type=None):
+    """
+    Converts the (question, answer) tuples of Generator.append_templates into export records.
+    """
+    for question, answer in temps:
+        yield {'question': question, 'answer': answer, 'question_type': question_type}
+
+
+def compress_block(block, compression, level):
+    if compression == GZIP:
+        return gzip.compress(block, compresslevel=level, mtime=0)
+    return zstandard.ZstdCompressor(level=level).compress(block)
+
+
+def decompress_block(data, compression):
+    if compression == GZIP:
+        return gzip.decompress(data)
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+def iter_blocks(records, rows_per_block):
+    """
+    :return: iterator of (number of rows, utf-8 encoded JSONL block)
+    """
+    lines = []
+    for record in records:
+        lines.append(json.dumps(record, ensure_ascii=False, default=to_json_value))
+        if len(lines) == rows_per_block:
+            yield len(lines), ('\n'.join(lines) + '\n').encode('utf-8')
+            lines = []
+    if lines:
+        yield len(lines), ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def export_jsonl(records, output_dir, *, name='questions', compression=GZIP, level=None,
+                 max_shard_bytes=64 * 2 ** 20, rows_per_block=1000, workers=None):
+    """
+    Exports records (see question_records and template_records) as sharded, compressed JSONL files for training.
+
+    Every shard consists of independently compressed blocks of rows_per_block rows. Concatenated gzip members and
+    zstd frames are valid files, so a shard can be streamed with any gzip or zstd reader. The manifest stores the
+    byte offset of every block, so a single row is read by decompressing a single block, see ShardedJsonl.
+    Blocks are compressed in parallel by a thread pool.
+
+    :param output_dir: directory of the shards and manifest.json
+    :param name: file name prefix of the shards
+    :param compression: 'gzip' or 'zstd' (requires the zstandard package)
+    :param level: compression level, defaults to 6 for gzip and 3 for zstd
+    :param max_shard_bytes: compressed size after which a new shard is started
+    :param rows_per_block: number of rows per compressed block
+    :param workers: number of compression threads, None for the number of CPUs
+    :return: manifest dict
+    """
+    if compression not in EXTENSIONS:
+        raise ValueError(f'Unknown compression {compression}, expected one of {", ".join(EXTENSIONS)}')
+    if compression == ZSTD and zstandard is None:
+        raise ImportError('zstd compression requires the zstandard package')
+    if level is None:
+        level = 6 if compression == GZIP else 3
+    os.makedirs(output_dir, exist_ok=True)
+
+    shards = []
+    shard = None
+    shard_file = None
+    digest = None
+    n_rows = 0
+
+    def close_shard():
+        shard_file.close()
+        shard['sha256'] = digest.hexdigest()
+        shards.append(shard)
+
+    workers = workers or os.cpu_count()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        blocks = iter_blocks(records, rows_per_block)
+        window = 2 * workers
+        pending = deque()
+        while True:
+            # keeps a bounded number of blocks in flight, so memory does not grow with the number of records
+            for n_block_rows, block in blocks:
+                pending.append((n_block_rows, len(block), executor.submit(compress_block, block, compression, level)))
+                if len(pending) >= window:
+                    break
+            if not pending:
+                break
+
+            n_block_rows, uncompressed_bytes, future = pending.popleft()
+            data = future.result()
+            if shard is not None and shard['bytes'] and shard['bytes'] + len(data) > max_shard_bytes:
+                close_shard()
+                shard = None
+            if shard is None:
+                file_name = f'{name}-{len(shards):05d}.{EXTENSIONS[compression]}'
+                shard = {'file': file_name, 'first_row': n_rows, 'rows': 0, 'bytes': 0, 'uncompressed_bytes': 0,
+                         'blocks': []}
+                shard_file = open(os.path.join(output_dir, file_name), 'wb')
+                digest = hashlib.sha256()
+
+            shard['blocks'].append([shard['bytes'], len(data), shard['rows'], n_block_rows])
+            shard_file.write(data)
+            digest.update(data)
+            shard['rows'] += n_block_rows
+            shard['bytes'] += len(data)
+            shard['uncompressed_bytes'] += uncompressed_bytes
+            n_rows += n_block_rows
+
+    if shard is not None:
+        close_shard()
+
+    manifest = {'name': name, 'compression': compression, 'rows': n_rows, 'rows_per_block': rows_per_block,
+                'shards': shards}
+    tmp_path = os.path.join(output_dir, f'{MANIFEST_NAME}.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, os.path.join(output_dir, MANIFEST_NAME))
+    return manifest
+
+
+def verify_shards(output_dir):
+    """
+    :return: list of the shard files whose checksum does not match the manifest
+    """
+    with open(os.path.join(output_dir, MANIFEST_NAME), encoding='utf-8') as f:
+        manifest = json.load(f)
+    corrupted = []
+    for shard in manifest['shards']:
+        digest = hashlib.sha256()
+        with open(os.path.join(output_dir, shard['file']), 'rb') as f:
+            for data in iter(lambda: f.read(2 ** 20), b''):
+                digest.update(data)
+        if digest.hexdigest() != shard['sha256']:
+            corrupted.append(shard['file'])
+    return corrupted
+
+
+class ShardedJsonl:
+    """
+    Streaming and random access reader of an export, see export_jsonl.
+    Only the blocks of the requested rows are read and decompressed.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        with open(os.path.join(output_dir, MANIFEST_NAME), encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self.compression = self.manifest['compression']
+        self.shard_starts = [shard['first_row'] for shard in self.manifest['shards']]
+
+    def __len__(self):
+        return self.manifest['rows']
+
+    def read_block(self, shard, block):
+        offset, length, _, _ = block
+        with open(os.path.join(self.output_dir, shard['file']), 'rb') as f:
+            f.seek(offset)
+            data = f.read(length)
+        return decompress_block(data, self.compression).decode('utf-8').splitlines()
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        shard = self.manifest['shards'][bisect.bisect_right(self.shard_starts, row) - 1]
+        row -= shard['first_row']
+        block_starts = [block[2] for block in shard['blocks']]
+        block = shard['blocks'][bisect.bisect_right(block_starts, row) - 1]
+        return json.loads(self.read_block(shard, block)[row - block[2]])
+
+    def iter_shard(self, shard_index):
+        """
+        Streams the records of one shard, e.g. one shard per data loader worker.
+        """
+        shard = self.manifest['shards'][shard_index]
+        for block in shard['blocks']:
+            for line in self.read_block(shard, block):
+                yield json.loads(line)
+
+    def __iter__(self):
+        for shard_index in range(len(self.manifest['shards'])):
+            yield from self.iter_shard(shard_index)
@@ -0,0 +1,236 @@
+import numpy as np
+import pandas as pd
+
+SUBJECT = 'subject'
+PREDICATE = 'predicate'
+OBJECT = 'object'
+FROM = 'from'
+UNTIL = 'until'
+FACT_COLUMNS = [SUBJECT, PREDICATE, OBJECT, FROM, UNTIL]
+
+CODE_DTYPE = np.int32
+MISSING_YEAR = -32768
+
+
+class FactTable:
+    """
+    Compact representation of temporal RDF facts.
+
+    Subjects and objects share one interned entity vocabulary and predicates have their own one.
+    Every fact is stored as int32 codes into those vocabularies plus the from and until years as int16
+    (int32 if a year does not fit). Strings are only decoded when a fact is rendered into a question.
+
+    Missing or not parsable years are stored as MISSING_YEAR.
+    """
+
+    def __init__(self, subject, predicate, object, time_from, time_until, entities, predicates, index=None):
+        self.subject = np.asarray(subject, dtype=CODE_DTYPE)
+        self.predicate = np.asarray(predicate, dtype=CODE_DTYPE)
+        self.object = np.asarray(object, dtype=CODE_DTYPE)
+        self.time_from = np.asarray(time_from)
+        self.time_until = np.asarray(time_until)
+        self.entities = entities
+        self.predicates = predicates
+        if index is None:
+            index = np.arange(len(self.subject), dtype=smallest_int_dtype(len(self.subject)))
+        self.index = np.asarray(index)
+
+    def __len__(self):
+        return len(self.subject)
+
+    def decode_fact(self, row):
+        """
+        Decodes a single fact into the strings and years the formulate_* functions of the Generator expect.
+
+        :param row: positional row of the fact
+        :return: subject, predicate, object, time_from, time_until whereby missing years are None
+        """
+        return (self.entities[self.subject[row]],
+                self.predicates[self.predicate[row]],
+                self.entities[self.object[row]],
+                decode_year(self.time_from[row]),
+                decode_year(self.time_until[row]))
+
+    def iter_facts(self, rows=None):
+        if rows is None:
+            rows = range(len(self))
+        for row in rows:
+            yield self.decode_fact(row)
+
+    def take(self, rows):
+        """
+        Returns a new FactTable containing only the given positional rows. The vocabularies are shared.
+        """
+        return FactTable(self.subject[rows], self.predicate[rows], self.object[rows],
+                         self.time_from[rows], self.time_until[rows],
+                         self.entities, self.predicates, index=self.index[rows])
+
+    def predicate_code(self, predicate):
+        return self.predicates.index(predicate)
+
+    def to_dataframe(self, rows=None):
+        """
+        Decodes the facts (or a positional selection of them) into a DataFrame with the usual fact columns.
+        """
+        if rows is None:
+            rows = slice(None)
+        return pd.DataFrame({SUBJECT: decode_codes(self.entities, self.subject[rows]),
+                             PREDICATE: decode_codes(self.predicates, self.predicate[rows]),
+                             OBJECT: decode_codes(self.entities, self.object[rows]),
+                             FROM: pd.array(np.where(self.time_from[rows] == MISSING_YEAR, None,
+                                                     self.time_from[rows]), dtype='Int32'),
+                             UNTIL: pd.array(np.where(self.time_until[rows] == MISSING_YEAR, None,
+                                                      self.time_until[rows]), dtype='Int32')},
+                            index=self.index[rows])
+
+    def memory_usage(self):
+        """
+        :return: approximated number of bytes used by the code arrays and the interned vocabularies
+        """
+        arrays = [self.subject, self.predicate, self.object, self.time_from, self.time_until, self.index]
+        vocabulary_bytes = sum(len(value.encode('utf-8')) for value in [*self.entities, *self.predicates])
+        return sum(array.nbytes for array in arrays) + vocabulary_bytes
+
+
+def from_dataframe(df, *, interner=None):
+    """
+    Interns a DataFrame with the columns subject, predicate, object, from and until into a FactTable.
+
+    :param df: DataFrame of temporal facts. from and until may be ints or date strings such as 1945-11-07
+    :param interner: Optional Interner that is reused, e.g. to share the vocabulary between chunks
+    :return: FactTable
+    """
+    if interner is None:
+        interner = Interner()
+    subject = interner.intern_entities(df[SUBJECT])
+    object = interner.intern_entities(df[OBJECT])
+    predicate = interner.intern_predicates(df[PREDICATE])
+    time_from = parse_years(df[FROM])
+    time_until = parse_years(df[UNTIL])
+    index = df.index.to_numpy()
+    if np.issubdtype(index.dtype, np.integer):
+        index = index.astype(smallest_int_dtype(index.max(initial=0)))
+    return FactTable(subject, predicate, object, time_from, time_until,
+                     interner.entities, interner.predicates, index=index)
+
+
+def read_fact_csv(path, *, chunksize=100_000, index_col=0):
+    """
+    Reads a fact CSV such as data/YAGO11k.csv or data/Cleansed_YAGO11k.csv into a FactTable.
+
+    The CSV is read in chunks and only the fact columns are loaded, so the full string DataFrame never has to be
+    kept in memory.
+
+    :param path: path of the CSV
+    :param chunksize: number of rows read at once
+    :param index_col: index column of the CSV, None if there is none
+    :return: FactTable
+    """
+    interner = Interner()
+    usecols = FACT_COLUMNS
+    if index_col is not None:
+        usecols = [pd.read_csv(path, nrows=0).columns[index_col], *FACT_COLUMNS]
+    chunks = pd.read_csv(path, usecols=usecols, index_col=index_col, chunksize=chunksize,
+                         dtype={SUBJECT: str, PREDICATE: str, OBJECT: str, FROM: str, UNTIL: str},
+                         keep_default_na=False)
+    tables = [from_dataframe(chunk, interner=interner) for chunk in chunks]
+    return concat_fact_tables(tables, interner)
+
+
+def concat_fact_tables(tables, interner):
+    """
+    Concatenates FactTables that were interned with the same Interner.
+    """
+    if not tables:
+        return FactTable([], [], [], np.array([], dtype=np.int16), np.array([], dtype=np.int16),
+                         interner.entities, interner.predicates)
+    year_dtype = np.result_type(*[table.time_from.dtype for table in tables],
+                                *[table.time_until.dtype for table in tables])
+    return FactTable(np.concatenate([table.subject for table in tables]),
+                     np.concatenate([table.predicate for table in tables]),
+                     np.concatenate([table.object for table in tables]),
+                     np.concatenate([table.time_from for table in tables]).astype(year_dtype),
+                     np.concatenate([table.time_until for table in tables]).astype(year_dtype),
+                     interner.entities, interner.predicates,
+                     index=np.concatenate([table.index for table in tables]))
+
+
+class Interner:
+    """
+    Assigns increasing int32 codes to entity and predicate strings.
+    """
+
+    def __init__(self):
+        self.entities = []
+        self.predicates = []
+        self._entity_codes = {}
+        self._predicate_codes = {}
+
+    def intern_entities(self, values):
+        return intern_strings(values, self._entity_codes, self.entities)
+
+    def intern_predicates(self, values):
+        return intern_strings(values, self._predicate_codes, self.predicates)
+
+
+def intern_strings(values, codes, vocabulary):
+    """
+    Maps every value onto its code and appends unseen values to the vocabulary.
+
+    :param values: iterable of strings
+    :param codes: dict value -> code which gets updated
+    :param vocabulary: list code -> value which gets updated
+    :return: numpy array of int32 codes
+    """
+    local_codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    mapping = np.empty(len(uniques), dtype=CODE_DTYPE)
+    for i, value in enumerate(uniques):
+        code = codes.get(value)
+        if code is None:
+            code = len(vocabulary)
+            codes[value] = code
+            vocabulary.append(value)
+        mapping[i] = code
+    return mapping[local_codes]
+
+
+def parse_years(values):
+    """
+    Vectorised year extraction. Accepts ints, year strings and date strings like 1945-11-07 or 100-##-##.
+
+    :return: int16 array (int32 if necessary) whereby not parsable values are MISSING_YEAR
+    """
+    series = pd.Series(values)
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        years = series.fillna(MISSING_YEAR).to_numpy(dtype=np.int64)
+    else:
+        extracted = series.astype(str).str.extract(r'^\s*(-?\d{1,4})(?:-|\s*$)', expand=False)
+        years = pd.to_numeric(extracted, errors='coerce').fillna(MISSING_YEAR).to_numpy(dtype=np.int64)
+    if years.size and (years.max() > np.iinfo(np.int16).max or years[years != MISSING_YEAR].min(
+            initial=0) < -np.iinfo(np.int16).max):
+        return years.astype(np.int32)
+    return years.astype(np.int16)
+
+
+def decode_codes(vocabulary, codes):
+    """
+    Decodes an array of codes. Every distinct code is only looked up once in the vocabulary.
+    """
+    uniques, inverse = np.unique(codes, return_inverse=True)
+    values = np.empty(len(uniques), dtype=object)
+    values[:] = [vocabulary[code] for code in uniques]
+    return values[inverse]
+
+
+def decode_year(year):
+    if year == MISSING_YEAR:
+        return None
+    return int(year)
+
+
+def smallest_int_dtype(max_value):
+    if max_value <= np.iinfo(np.int16).max:
+        return np.int16
+    if max_value <= np.iinfo(np.int32).max:
+        return np.int32
+    return np.int64
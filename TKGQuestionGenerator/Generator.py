@@ -1,3 +1,6 @@
+import functools
+
+import pandas as pd
 import spacy
 
 from typing import List
@@ -453,6 +456,76 @@ def formulate_while_question(subject1, predicate1, object1,
     pass
 
 
+# question type -> (formulate function, fixed keyword arguments)
+# every formulate function is called with subject, predicate, object, time_from, time_until as positional arguments
+QUESTION_TYPES = {
+    'yes_no': (formulate_yes_no_question, {}),
+    'yes_no_robust': (formulate_yes_no_question, {'produce_all_interval_questions': True}),
+    'when': (formulate_simple_when_question, {}),
+    'when_to_when': (formulate_when_to_when_question, {}),
+    'from_when': (formulate_from_or_until_question, {'is_from_question': True}),
+    'until_when': (formulate_from_or_until_question, {'is_from_question': False}),
+    'left_open': (formulate_left_or_right_open_interval_questions, {'right_open': False}),
+    'right_open': (formulate_left_or_right_open_interval_questions, {'right_open': True}),
+    'duration': (formulate_duration_question, {}),
+}
+
+
+def formulate_questions(question_type, subject, predicate, object, time_from, time_until, **kwargs):
+    """
+    Calls the formulate function registered for question_type in QUESTION_TYPES.
+
+    :param question_type: key of QUESTION_TYPES
+    :param kwargs: keyword arguments passed on to the formulate function such as predicate_question_dict
+    :return: A list of tuples containing the question and its answer or None if no question can be formulated
+    """
+    formulate, fixed_kwargs = QUESTION_TYPES[question_type]
+    return formulate(subject, predicate, object, time_from, time_until, **fixed_kwargs, **kwargs)
+
+
+def generate_questions(fact_table, question_type, *, rows=None, **kwargs) -> pd.DataFrame:
+    """
+    Generates the questions of one question type for the facts of a FactTable.
+
+    The strings of a fact are only decoded from the interned FactTable when the question is rendered.
+    Facts without a from year are skipped.
+
+    The returned DataFrame has one row per question with the columns
+    {question_type}_qe, {question_type}_an, predicate and qe_index whereby qe_index is the index of the fact.
+
+    :param fact_table: FactTable of temporal RDFs
+    :param question_type: key of QUESTION_TYPES
+    :param rows: Optional iterable of positional rows of the FactTable
+    :param kwargs: keyword arguments passed on to the formulate function such as predicate_question_dict
+    :return: DataFrame of the generated questions
+    """
+    questions = []
+    answers = []
+    predicates = []
+    qe_indices = []
+
+    if rows is None:
+        rows = range(len(fact_table))
+
+    for row in rows:
+        subject, predicate, object, time_from, time_until = fact_table.decode_fact(row)
+        if time_from is None:
+            continue
+        temps = formulate_questions(question_type, subject, predicate, object, time_from, time_until, **kwargs)
+        if not temps:
+            continue
+        for question, answer in temps:
+            questions.append(question)
+            answers.append(answer)
+            predicates.append(predicate)
+            qe_indices.append(fact_table.index[row])
+
+    return pd.DataFrame({f'{question_type}_qe': questions,
+                         f'{question_type}_an': answers,
+                         'predicate': predicates,
+                         'qe_index': qe_indices})
+
+
 ####################### Helper Functions #######################
 
 def process_predicate(predicate, pos=True):
@@ -473,9 +546,11 @@ def elaborate_spacy_pos(predicate):
     print(f'{predicate} -> {process_predicate(predicate, False)}')
 
 
+@functools.lru_cache(maxsize=2 ** 16)
 def lemma_predicate(predicate, lemma=True):
     """
     Converts a predicate into its lemma form and removes leading be and have.
+    Results are cached, since a TKG has few distinct predicates but every fact parses its predicate.
 
     Examples:
         - is affiliated to  -> affiliate to
@@ -1,4 +1,7 @@
 import re
+from statistics import NormalDist
+
+import numpy as np
 from word2number import w2n
 
 
@@ -20,6 +23,17 @@ def sec_to_hour(sec):
 
     return f'{hours_no_decimal} h {round(total_min)} min'
 
+
+def min_sec_to_sec(time_processed: str):
+    """
+    Inverse of sec_to_min, e.g. '23 min 36 sec' -> 1416
+    """
+    m = re.search(r'(\d+) min (\d+) sec', time_processed)
+    if not m:
+        raise ValueError(f'{time_processed} is not in the format of sec_to_min')
+    return int(m.group(1)) * 60 + int(m.group(2))
+
+
 def min_to_hour(min):
     hour = min / 60
     hour_no_decimal = int(hour)
@@ -169,7 +183,50 @@ def remove_underline_and_capitalise(question_type: str):
     return question_type.replace('_', ' ').title()
 
 
+LATEX_SPECIAL_CHARS = {'\\': r'\textbackslash{}', '&': r'\&', '%': r'\%', '$': r'\$', '#': r'\#', '_': r'\_',
+                       '{': r'\{', '}': r'\}', '~': r'\textasciitilde{}', '^': r'\textasciicircum{}'}
+
+
+def escape_latex(string: str):
+    return ''.join(LATEX_SPECIAL_CHARS.get(char, char) for char in string)
+
+
 # qe -> question
 def estimated_model_time_consumption(n_qe, sec_per_100_qe):
     n_qe = n_qe/100
-    return sec_to_hour(sec_per_100_qe * n_qe)
\ No newline at end of file
+    return sec_to_hour(sec_per_100_qe * n_qe)
+
+
+def wilson_interval(percentage, n, confidence_level=0.95):
+    """
+    Wilson score interval of a proportion. Works for scalars as well as numpy arrays.
+
+    :param percentage: observed proportion between 0 and 1
+    :param n: (effective) sample size
+    :param confidence_level: e.g. 0.95
+    :return: lower and upper bound
+    """
+    percentage = np.asarray(percentage, dtype=float)
+    n = np.asarray(n, dtype=float)
+    z = NormalDist().inv_cdf(1 - (1 - confidence_level) / 2)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denominator = 1 + z ** 2 / n
+        center = (percentage + z ** 2 / (2 * n)) / denominator
+        margin = z * np.sqrt(percentage * (1 - percentage) / n + z ** 2 / (4 * n ** 2)) / denominator
+    ci_low = np.where(n > 0, np.maximum(0.0, center - margin), 0.0)
+    ci_high = np.where(n > 0, np.minimum(1.0, center + margin), 1.0)
+    if ci_low.ndim == 0:
+        return float(ci_low), float(ci_high)
+    return ci_low, ci_high
+
+
+def answer_confidences(answers):
+    """
+    :param answers: model answers, answers of scoring functions carry a confidence (see Inference.ScoredAnswer)
+    :return: list of the confidences with NaN for answers without one, or None if no answer has a confidence
+    """
+    confidences = [getattr(answer, 'confidence', np.nan) for answer in answers]
+    if all(np.isnan(confidence) for confidence in confidences):
+        return None
+    return confidences
@@ -0,0 +1,147 @@
+import functools
+import hashlib
+import inspect
+import json
+import os
+import uuid
+
+import pandas as pd
+import spacy
+
+import TKGQuestionGenerator.Generator as qm
+
+QE_KEY = 'qe_key'
+SEPARATOR = '\x1f'
+
+
+def fingerprint(*values) -> str:
+    """
+    :return: 16 hex digit blake2b fingerprint of the string representation of the values
+    """
+    joined = SEPARATOR.join(str(value) for value in values)
+    return hashlib.blake2b(joined.encode('utf-8'), digest_size=8).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def generator_fingerprint() -> str:
+    """
+    :return: fingerprint of the source of the Generator module and of the spaCy version and model it lemmatizes with
+    """
+    return fingerprint(inspect.getsource(qm), spacy.__version__, qm.nlp.meta.get('lang'), qm.nlp.meta.get('name'),
+                       qm.nlp.meta.get('version'))
+
+
+def fingerprint_config(question_type, **kwargs) -> str:
+    """
+    Fingerprints everything that influences the questions of a question type except the custom templates of the
+    predicate_question_dict. Those are fingerprinted per predicate, so changing the template of one predicate
+    only regenerates the questions of that predicate.
+
+    The source code of the Generator module (the formulate functions, their templates and helpers such as
+    lemma_predicate and check_time) and the name and version of the spaCy model are part of the fingerprint, hence
+    changes of the built-in templates or of the lemmatisation regenerate the questions as well.
+
+    :param question_type: key of Generator.QUESTION_TYPES
+    :param kwargs: keyword arguments passed on to the formulate function
+    :return: fingerprint
+    """
+    _, fixed_kwargs = qm.QUESTION_TYPES[question_type]
+    config = {key: value for key, value in kwargs.items() if key != 'predicate_question_dict'}
+    return fingerprint(question_type,
+                       generator_fingerprint(),
+                       json.dumps(fixed_kwargs, sort_keys=True, default=str),
+                       json.dumps(config, sort_keys=True, default=str))
+
+
+def question_keys(fact_table, question_type, rows=None, **kwargs):
+    """
+    Computes the key of every fact row. The key changes if the fact, the configuration of the question type or the
+    custom template of the predicate of the fact changes.
+
+    :return: list of keys in the order of rows
+    """
+    config_fingerprint = fingerprint_config(question_type, **kwargs)
+    predicate_question_dict = kwargs.get('predicate_question_dict') or {}
+
+    if rows is None:
+        rows = range(len(fact_table))
+
+    keys = []
+    for row in rows:
+        subject, predicate, object, time_from, time_until = fact_table.decode_fact(row)
+        keys.append(fingerprint(config_fingerprint, predicate_question_dict.get(predicate, ''),
+                                subject, predicate, object, time_from, time_until))
+    return keys
+
+
+def load_manifest(path):
+    """
+    :return: manifest of the previous run or an empty one if there is none
+    """
+    if not os.path.exists(path):
+        return {'question_types': {}}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, path):
+    """
+    Writes the manifest atomically. Should be called once the delta has been processed downstream.
+    """
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def generate_incremental(fact_table, question_type, manifest, **kwargs):
+    """
+    Generates only the questions of facts that were added or changed since the run recorded in the manifest.
+
+    As an example:
+    - a fact got a new until year -> its old key is deleted and the questions for the new key are generated
+    - the template of 'was born in' in predicate_question_dict changed -> all 'was born in' questions are
+      regenerated, all other questions are kept
+
+    :param fact_table: FactTable of temporal RDFs
+    :param question_type: key of Generator.QUESTION_TYPES
+    :param manifest: manifest of the previous run, see load_manifest. It is not modified.
+    :param kwargs: keyword arguments passed on to the formulate function such as predicate_question_dict
+    :return: DataFrame of the added or changed questions with an additional qe_key column,
+    list of deleted qe_keys and the manifest of this run. The manifest maps every key of a question type to the
+    current index of its fact, see apply_delta.
+    """
+    keys = question_keys(fact_table, question_type, **kwargs)
+    previous_keys = set(manifest['question_types'].get(question_type, []))
+
+    changed_rows = [row for row, key in enumerate(keys) if key not in previous_keys]
+    questions = qm.generate_questions(fact_table, question_type, rows=changed_rows, **kwargs)
+    key_by_index = dict(zip(fact_table.index[changed_rows], (keys[row] for row in changed_rows)))
+    questions[QE_KEY] = questions['qe_index'].map(key_by_index)
+
+    current_keys = set(keys)
+    deleted_keys = sorted(previous_keys - current_keys)
+
+    # the fact table may have been reindexed since the previous run, hence the current index of every key is kept
+    index_of_key = {key: int(index) for key, index in sorted(zip(keys, fact_table.index))}
+    new_manifest = {'question_types': {**manifest['question_types'], question_type: index_of_key}}
+    return questions, deleted_keys, new_manifest
+
+
+def apply_delta(previous_df, delta_df, deleted_keys, index_of_key=None):
+    """
+    Merges the (answered) delta of an incremental run into the (answered) questions of the previous run.
+
+    :param previous_df: DataFrame of the previous run with a qe_key column
+    :param delta_df: DataFrame of the added or changed questions with a qe_key column
+    :param deleted_keys: keys returned by generate_incremental
+    :param index_of_key: dict key -> current index of the fact, new_manifest['question_types'][question_type] of
+    generate_incremental. The qe_index of the kept questions is updated with it, so kept and new facts never share
+    an index if the facts were reindexed since the previous run.
+    :return: DataFrame covering the current facts
+    """
+    replaced_keys = set(deleted_keys) | set(delta_df[QE_KEY])
+    kept = previous_df[~previous_df[QE_KEY].isin(replaced_keys)]
+    if index_of_key is not None:
+        kept = kept.assign(qe_index=kept[QE_KEY].map(index_of_key).astype(kept['qe_index'].dtype))
+    return pd.concat([kept, delta_df], ignore_index=True)
@@ -0,0 +1,421 @@
+import time
+
+import numpy as np
+import torch
+from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+
+import TKGQuestionGenerator.FactTable as ft
+import TKGQuestionGenerator.HelperUtils as helper
+
+
+def load_model(model_name, device='cpu'):
+    """
+    Loads a text2text-generation model such as bigscience/T0_3B and its tokenizer.
+
+    :return: model in eval mode and tokenizer
+    """
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSeq2SeqLM.from_pretrained(model_name).to(device)
+    model.eval()
+    return model, tokenizer
+
+
+def create_tiny_model(path, texts, *, vocab_size=2000, seed=0):
+    """
+    Creates a tiny randomly initialised T5 model with a unigram tokenizer trained on texts, e.g. generated
+    questions. Its answers are meaningless, but it exercises the complete inference code path within seconds.
+
+    :param path: directory the model and tokenizer are saved to
+    :param texts: list of texts the tokenizer is trained on
+    :return: path
+    """
+    from tokenizers import SentencePieceUnigramTokenizer
+    from tokenizers.processors import TemplateProcessing
+    from transformers import T5Config, T5ForConditionalGeneration, T5TokenizerFast
+
+    unigram = SentencePieceUnigramTokenizer()
+    unigram.train_from_iterator(texts, vocab_size=vocab_size, special_tokens=['<pad>', '</s>', '<unk>'],
+                                unk_token='<unk>', show_progress=False)
+    unigram._tokenizer.post_processor = TemplateProcessing(single='$A </s>', special_tokens=[('</s>', 1)])
+    tokenizer = T5TokenizerFast(tokenizer_object=unigram._tokenizer, pad_token='<pad>', eos_token='</s>',
+                                unk_token='<unk>', extra_ids=0)
+
+    torch.manual_seed(seed)
+    config = T5Config(vocab_size=len(tokenizer), d_model=32, d_ff=64, num_layers=2, num_heads=2, d_kv=16,
+                      decoder_start_token_id=tokenizer.pad_token_id, pad_token_id=tokenizer.pad_token_id,
+                      eos_token_id=tokenizer.eos_token_id)
+    T5ForConditionalGeneration(config).save_pretrained(path)
+    tokenizer.save_pretrained(path)
+    return path
+
+
+def decode_answer(tokenizer, ids):
+    """
+    Decodes generated ids up to the first eos token including the special tokens, e.g. '<pad> yes</s>'.
+    That is the format HelperUtils.remove_unnecessary_model_answer_chars expects.
+    """
+    ids = list(ids)
+    if tokenizer.eos_token_id in ids:
+        ids = ids[:ids.index(tokenizer.eos_token_id) + 1]
+    return tokenizer.decode(ids, skip_special_tokens=False, clean_up_tokenization_spaces=False)
+
+
+def torch_generate(model):
+    """
+    :return: generate function of a PyTorch model in the signature of OnnxInference.OnnxSeq2SeqModel.generate,
+    generate(input_ids, attention_mask, *, max_new_tokens) with numpy inputs
+    """
+    def generate(input_ids, attention_mask, *, max_new_tokens=10):
+        with torch.no_grad():
+            return model.generate(input_ids=torch.from_numpy(input_ids).to(model.device),
+                                  attention_mask=torch.from_numpy(attention_mask).to(model.device),
+                                  max_new_tokens=max_new_tokens)
+    return generate
+
+
+def answer_questions(questions, model, tokenizer, *, batch_size=32, max_new_tokens=10, generate=None):
+    """
+    Answers closed book questions with free-form generation.
+
+    :param questions: list of questions
+    :param model: text2text-generation model
+    :param tokenizer: tokenizer of the model
+    :param batch_size: number of questions per forward pass
+    :param max_new_tokens: maximal length of an answer
+    :param generate: Optional generate function of another backend such as OnnxSeq2SeqModel.generate, defaults to
+    torch_generate(model)
+    :return: list of raw model answers such as '<pad> yes</s>'
+    """
+    generate = generate or torch_generate(model)
+    answers = []
+    for start in range(0, len(questions), batch_size):
+        batch = tokenizer(list(questions[start:start + batch_size]), return_tensors='np', padding=True)
+        outputs = generate(batch['input_ids'], batch['attention_mask'], max_new_tokens=max_new_tokens)
+        answers.extend(decode_answer(tokenizer, output.tolist()) for output in outputs)
+    return answers
+
+
+def answer_token_cache(token_cache, model, tokenizer, *, rows=None, batch_size=32, max_new_tokens=10,
+                       generate=None):
+    """
+    Answers pre-tokenized questions, see TokenCache.load_token_cache. Questions of similar length are batched
+    together, so the forward passes compute little padding.
+
+    :param token_cache: TokenCache of a question store built with the tokenizer of the model
+    :param rows: Optional rows of the question store, None for all questions
+    :param generate: see answer_questions
+    :return: list of raw model answers such as '<pad> yes</s>' in the order of rows
+    """
+    generate = generate or torch_generate(model)
+    if rows is None:
+        rows = np.arange(len(token_cache))
+    rows = np.asarray(rows)
+    position_of_row = {row: position for position, row in enumerate(rows.tolist())}
+
+    answers = [None] * len(rows)
+    for bucket in token_cache.length_buckets(batch_size, rows):
+        input_ids, attention_mask = token_cache.padded_batch(bucket)
+        outputs = generate(input_ids, attention_mask, max_new_tokens=max_new_tokens)
+        for row, output in zip(bucket.tolist(), outputs):
+            answers[position_of_row[row]] = decode_answer(tokenizer, output.tolist())
+    return answers
+
+
+def make_answer_function(model, tokenizer, **kwargs):
+    """
+    :return: function answering a list of questions, see answer_questions
+    """
+    return lambda questions: answer_questions(questions, model, tokenizer, **kwargs)
+
+
+def make_token_answer_function(model, tokenizer, **kwargs):
+    """
+    :return: function answering rows of a TokenCache, see answer_token_cache
+    """
+    return lambda token_cache, rows: answer_token_cache(token_cache, model, tokenizer, rows=rows, **kwargs)
+
+
+def answer_sequences(tokenizer, answers):
+    """
+    Token ids of complete answers including the end of sequence token. 'yes' and 'no' are single tokens for T5
+    tokenizers ('▁yes' and '▁no'), other tokenizers split them, e.g. into '▁ye' 's' and '▁' 'no'.
+
+    :return: list of the token ids of every answer
+    """
+    sequences = []
+    for answer in answers:
+        ids = tokenizer(answer, add_special_tokens=False)['input_ids']
+        sequences.append([*ids, tokenizer.eos_token_id] if tokenizer.eos_token_id is not None else ids)
+    if len({tuple(ids) for ids in sequences}) != len(sequences):
+        raise ValueError(f'The answers {answers} have the same token ids')
+    return sequences
+
+
+def decoder_inputs(sequences, decoder_start_token_id, pad_token_id):
+    """
+    :return: int64 array (sequences, longest sequence) of the decoder inputs of teacher forcing: the decoder start
+    token followed by every sequence without its last token, padded at the end
+    """
+    decoder_input_ids = np.full((len(sequences), max(map(len, sequences))), pad_token_id, dtype=np.int64)
+    for i, ids in enumerate(sequences):
+        decoder_input_ids[i, :len(ids)] = [decoder_start_token_id, *ids[:-1]]
+    return decoder_input_ids
+
+
+def sequence_logits(model, input_ids, attention_mask, sequences):
+    """
+    Encodes a batch of questions once and runs the decoder over every answer sequence of every question with
+    teacher forcing in one forward pass.
+
+    :param model: text2text-generation model or a model with a sequence_logits method such as
+    OnnxInference.OnnxSeq2SeqModel
+    :param sequences: token ids of the answers, see answer_sequences
+    :return: numpy array (batch, sequences, longest sequence, vocabulary), position t holds the logits of token t
+    """
+    if hasattr(model, 'sequence_logits'):
+        return model.sequence_logits(input_ids, attention_mask, sequences)
+    decoder_input_ids = decoder_inputs(sequences, model.config.decoder_start_token_id, model.config.pad_token_id)
+    input_ids = torch.as_tensor(input_ids, device=model.device)
+    attention_mask = torch.as_tensor(attention_mask, device=model.device)
+    with torch.no_grad():
+        encoder_hidden_states = model.get_encoder()(input_ids=input_ids, attention_mask=attention_mask)[0]
+        logits = model(encoder_outputs=(encoder_hidden_states.repeat_interleave(len(sequences), dim=0),),
+                       attention_mask=attention_mask.repeat_interleave(len(sequences), dim=0),
+                       decoder_input_ids=torch.from_numpy(decoder_input_ids).to(model.device).repeat(len(input_ids), 1),
+                       use_cache=False).logits
+    return logits.float().cpu().numpy().reshape(len(input_ids), len(sequences), *logits.shape[1:])
+
+
+def sequence_log_probs(model, input_ids, attention_mask, sequences):
+    """
+    :return: numpy array (batch, sequences) of the log probability of every complete answer sequence
+    """
+    logits = sequence_logits(model, input_ids, attention_mask, sequences)
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    log_probs = logits - np.log(np.exp(logits).sum(axis=-1, keepdims=True))
+    scores = np.zeros(logits.shape[:2])
+    for i, ids in enumerate(sequences):
+        scores[:, i] = log_probs[:, i, np.arange(len(ids)), ids].sum(axis=-1)
+    return scores
+
+
+def score_yes_no(questions, model, tokenizer, *, batch_size=32):
+    """
+    Answers yes no questions by comparing the likelihood of the complete answers 'yes' and 'no' instead of
+    generating free-form text. Every answer is valid.
+
+    :return: list of answers ('yes' or 'no') and numpy array of their confidence, the probability of the answer
+    normalised over yes and no
+    """
+    sequences = answer_sequences(tokenizer, ['yes', 'no'])
+    answers = []
+    confidences = np.zeros(len(questions))
+    for start in range(0, len(questions), batch_size):
+        batch = tokenizer(list(questions[start:start + batch_size]), return_tensors='np', padding=True)
+        scores = sequence_log_probs(model, batch['input_ids'], batch['attention_mask'], sequences)
+        probabilities = np.exp(scores - scores.max(axis=1, keepdims=True))
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        answers.extend(np.where(probabilities[:, 0] >= probabilities[:, 1], 'yes', 'no').tolist())
+        confidences[start:start + len(scores)] = probabilities.max(axis=1)
+    return answers, confidences
+
+
+class ScoredAnswer(str):
+    """
+    Answer of a scoring function together with its confidence. Behaves like the formatted answer string, so it
+    replaces generated answers transparently, see HelperUtils.answer_confidences.
+    """
+
+    def __new__(cls, answer, confidence):
+        scored = super().__new__(cls, answer)
+        scored.confidence = float(confidence)
+        return scored
+
+
+def make_yes_no_scoring_function(model, tokenizer, **kwargs):
+    """
+    :return: function answering a list of yes no questions with score_yes_no. The answers are formatted like
+    the generated answers of T5 style models, e.g. '<pad> yes</s>', so it can replace the function of
+    make_answer_function. They are ScoredAnswers carrying the confidence of score_yes_no.
+    """
+    formatted = {answer: format_answer(tokenizer, answer) for answer in ['yes', 'no']}
+
+    def answer_function(questions):
+        answers, confidences = score_yes_no(questions, model, tokenizer, **kwargs)
+        return [ScoredAnswer(formatted[answer], confidence) for answer, confidence in zip(answers, confidences)]
+    return answer_function
+
+
+def year_candidates(first=None, last=None, *, fact_table=None, margin=10):
+    """
+    Candidate years of when, until_when, left_open and right_open questions.
+
+    :param first: first year, defaults to the earliest year of fact_table minus margin
+    :param last: last year, defaults to the latest year of fact_table plus margin
+    :param fact_table: Optional FactTable the questions are generated from, without it the years 1000 to 2030 are
+    used by default
+    :param margin: years the range of fact_table is extended by, so a model may answer a year off
+    :return: list of the years as strings
+    """
+    if fact_table is not None:
+        years = np.concatenate([fact_table.time_from, fact_table.time_until])
+        years = years[years != ft.MISSING_YEAR]
+        if len(years):
+            first = int(years.min()) - margin if first is None else first
+            last = int(years.max()) + margin if last is None else last
+    first = 1000 if first is None else max(first, 0)
+    last = 2030 if last is None else last
+    return [str(year) for year in range(first, last + 1)]
+
+
+def duration_candidates(longest=150):
+    return [str(duration) for duration in range(longest + 1)]
+
+
+def candidate_trie(tokenizer, candidates):
+    """
+    :return: dict token id prefix -> allowed next token ids of the candidates followed by eos and dict token ids ->
+    candidate
+    """
+    trie = {}
+    candidate_of_ids = {}
+    for candidate in candidates:
+        ids = (*tokenizer(candidate, add_special_tokens=False)['input_ids'], tokenizer.eos_token_id)
+        candidate_of_ids[ids] = candidate
+        for i in range(len(ids)):
+            trie.setdefault(ids[:i], set()).add(ids[i])
+    return {prefix: sorted(ids) for prefix, ids in trie.items()}, candidate_of_ids
+
+
+def rank_candidates(questions, model, tokenizer, candidates, *, k=5, batch_size=8):
+    """
+    Answers questions with constrained beam search: every beam is restricted to the token sequences of the
+    candidates, e.g. year_candidates for when questions or duration_candidates for duration questions. No decoding
+    step is spent on text that would be thrown away and every answer is valid.
+
+    :param candidates: list of candidate answers
+    :param k: number of ranked answers per question
+    :return: list of the k (candidate, probability) pairs of every question, most likely first. The probability is
+    the likelihood of the candidate (including eos) under the model.
+    """
+    trie, candidate_of_ids = candidate_trie(tokenizer, candidates)
+    k = min(k, len(candidate_of_ids))
+    # greedy search has no sequences_scores, hence k=1 uses two beams and keeps the first
+    num_beams = max(k, 2)
+    max_new_tokens = max(len(ids) for ids in candidate_of_ids)
+
+    def allowed_tokens(_, input_ids):
+        return trie.get(tuple(input_ids[1:].tolist()), [tokenizer.pad_token_id])
+
+    ranked = []
+    for start in range(0, len(questions), batch_size):
+        batch = tokenizer(list(questions[start:start + batch_size]), return_tensors='pt', padding=True)
+        batch = batch.to(model.device)
+        with torch.no_grad():
+            outputs = model.generate(**batch, num_beams=num_beams, num_return_sequences=num_beams, length_penalty=0.0,
+                                     do_sample=False, max_new_tokens=max_new_tokens,
+                                     prefix_allowed_tokens_fn=allowed_tokens, return_dict_in_generate=True,
+                                     output_scores=True)
+        probabilities = outputs.sequences_scores.exp().view(-1, num_beams)[:, :k].tolist()
+        sequences = outputs.sequences.view(-1, num_beams, outputs.sequences.shape[-1])[:, :k].tolist()
+        for question_sequences, question_probabilities in zip(sequences, probabilities):
+            ranked.append([(candidate_of_ids[tuple(ids[1:ids.index(tokenizer.eos_token_id) + 1])], probability)
+                           for ids, probability in zip(question_sequences, question_probabilities)])
+    return ranked
+
+
+def answer_ranked_df(df, question_type, model, tokenizer, candidates, *, k=5, batch_size=8):
+    """
+    Answers the questions of a DataFrame with rank_candidates. Adds {question_type}_ranked with the ranked
+    (candidate, probability) pairs and, formatted like a generated answer, the most likely candidate as
+    {question_type}_model_an, so the eval functions of the ResultEvaluator work as before.
+    See ResultEvaluator.eval_top_k.
+    """
+    df = df.copy()
+    start = time.time()
+    ranked = rank_candidates(df[f'{question_type}_qe'].tolist(), model, tokenizer, candidates, k=k,
+                             batch_size=batch_size)
+    df[f'{question_type}_time'] = time.time() - start
+    df[f'{question_type}_ranked'] = ranked
+    df[f'{question_type}_model_an'] = [format_answer(tokenizer, answers[0][0]) for answers in ranked]
+    return df
+
+
+def format_answer(tokenizer, answer):
+    """
+    :return: answer formatted like a generated answer, e.g. '<pad> 1992</s>'
+    """
+    return decode_answer(tokenizer, [tokenizer.pad_token_id, *tokenizer(answer, add_special_tokens=False)['input_ids'],
+                                     tokenizer.eos_token_id])
+
+
+def answer_question_df(df, question_type, answer_function):
+    """
+    Answers all questions of a DataFrame in the layout of Generator.generate_questions and adds the columns
+    {question_type}_model_an and {question_type}_time that the eval functions of the ResultEvaluator expect,
+    and {question_type}_confidence for answer functions that score their answers.
+    """
+    df = df.copy()
+    start = time.time()
+    df[f'{question_type}_model_an'] = answer_function(df[f'{question_type}_qe'].tolist())
+    df[f'{question_type}_time'] = time.time() - start
+    add_confidences(df, question_type)
+    return df
+
+
+def add_confidences(df, question_type):
+    """
+    Adds the {question_type}_confidence column if the model answers carry confidences, see ScoredAnswer.
+    """
+    confidences = helper.answer_confidences(df[f'{question_type}_model_an'])
+    if confidences is not None:
+        df[f'{question_type}_confidence'] = confidences
+
+
+def answer_yes_no_robust_adaptive(df, answer_function, *, questions_per_entity=1, question_type='yes_no_robust'):
+    """
+    Answers robust yes no questions entity by entity and stops asking about an entity (qe_index) as soon as one of
+    its questions is answered incorrectly.
+
+    The questions of all entities that are still correct are answered together in rounds, every round asks the
+    next questions_per_entity questions of each entity. Cancelled questions keep a NaN model answer, so
+    ResultEvaluator.eval_yes_no_robust drops them and the correctly_answered_entities stay the same as if every
+    question had been answered. size, valid_answer and correct_answer only cover the asked questions.
+
+    :param df: DataFrame with {question_type}_qe, {question_type}_an and qe_index
+    :param answer_function: function answering a list of questions, see make_answer_function
+    :param questions_per_entity: number of questions per entity and round
+    :param question_type: prefix of the question columns
+    :return: DataFrame with {question_type}_model_an and {question_type}_time (and {question_type}_confidence, see
+    add_confidences) and the number of cancelled questions
+    """
+    qe = f'{question_type}_qe'
+    an = f'{question_type}_an'
+    model_an = f'{question_type}_model_an'
+
+    df = df.copy()
+    df[model_an] = np.nan
+    df[model_an] = df[model_an].astype(object)
+    round_of_question = df.groupby('qe_index', sort=False).cumcount().to_numpy() // questions_per_entity
+    qe_indices = df['qe_index'].to_numpy()
+
+    failed_entities = set()
+    start = time.time()
+    for current_round in range(round_of_question.max(initial=-1) + 1):
+        positions = np.flatnonzero(round_of_question == current_round)
+        positions = [position for position in positions if qe_indices[position] not in failed_entities]
+        if not positions:
+            break
+
+        answers = answer_function(df[qe].iloc[positions].tolist())
+        df.iloc[positions, df.columns.get_loc(model_an)] = answers
+
+        for position, answer in zip(positions, answers):
+            answer = helper.remove_unnecessary_model_answer_chars(answer.lower())
+            if not helper.check_yes_no_correct(df[an].iat[position], answer):
+                failed_entities.add(qe_indices[position])
+
+    df[f'{question_type}_time'] = time.time() - start
+    add_confidences(df, question_type)
+    n_cancelled = int(df[model_an].isna().sum())
+    return df, n_cancelled
@@ -0,0 +1,226 @@
+import functools
+import json
+import os
+
+import numpy as np
+import onnxruntime as ort
+import pandas as pd
+from onnxruntime.quantization import QuantType, quantize_dynamic
+from transformers import AutoTokenizer
+
+import TKGQuestionGenerator.Inference as inference
+import TKGQuestionGenerator.ResultEvaluator as ev
+
+ENCODER = 'encoder'
+DECODER = 'decoder'
+CONFIG_NAME = 'onnx_config.json'
+OPSET_VERSION = 17
+
+
+def model_file(model_dir, part, quantized):
+    return os.path.join(model_dir, f'{part}.int8.onnx' if quantized else f'{part}.onnx')
+
+
+def export_model(model_name, model_dir, *, quantize=True):
+    """
+    Exports a text2text-generation model such as bigscience/T0_3B into an encoder and a decoder ONNX graph and
+    optionally quantizes the weights of both dynamically to int8.
+
+    The decoder graph has no past key values: it recomputes the decoder over all generated tokens per step, which
+    is cheap for answers of a few tokens and keeps the graph simple.
+
+    :param model_name: name or path of the model
+    :param model_dir: output directory of the graphs, the tokenizer and onnx_config.json
+    :param quantize: additionally writes encoder.int8.onnx and decoder.int8.onnx
+    :return: model_dir
+    """
+    import torch
+
+    model, tokenizer = inference.load_model(model_name)
+    os.makedirs(model_dir, exist_ok=True)
+
+    class Encoder(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.encoder = model.get_encoder()
+
+        def forward(self, input_ids, attention_mask):
+            return self.encoder(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+
+    class Decoder(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, decoder_input_ids, encoder_hidden_states, attention_mask):
+            return self.model(encoder_outputs=(encoder_hidden_states,), attention_mask=attention_mask,
+                              decoder_input_ids=decoder_input_ids, use_cache=False).logits
+
+    # the traced example needs padding and more than one decoder token, otherwise the tracer drops the masks
+    input_ids = torch.full((2, 5), tokenizer.eos_token_id, dtype=torch.long)
+    attention_mask = torch.ones((2, 5), dtype=torch.long)
+    attention_mask[1, 3:] = 0
+    decoder_input_ids = torch.full((2, 3), model.config.decoder_start_token_id, dtype=torch.long)
+    with torch.no_grad():
+        encoder_hidden_states = Encoder()(input_ids, attention_mask)
+        torch.onnx.export(Encoder(), (input_ids, attention_mask), model_file(model_dir, ENCODER, False),
+                          input_names=['input_ids', 'attention_mask'], output_names=['last_hidden_state'],
+                          dynamic_axes={'input_ids': {0: 'batch', 1: 'sequence'},
+                                        'attention_mask': {0: 'batch', 1: 'sequence'},
+                                        'last_hidden_state': {0: 'batch', 1: 'sequence'}},
+                          opset_version=OPSET_VERSION, dynamo=False)
+        torch.onnx.export(Decoder(), (decoder_input_ids, encoder_hidden_states, attention_mask),
+                          model_file(model_dir, DECODER, False),
+                          input_names=['decoder_input_ids', 'encoder_hidden_states', 'attention_mask'],
+                          output_names=['logits'],
+                          dynamic_axes={'decoder_input_ids': {0: 'batch', 1: 'decoded'},
+                                        'encoder_hidden_states': {0: 'batch', 1: 'sequence'},
+                                        'attention_mask': {0: 'batch', 1: 'sequence'},
+                                        'logits': {0: 'batch', 1: 'decoded'}},
+                          opset_version=OPSET_VERSION, dynamo=False)
+
+    if quantize:
+        for part in [ENCODER, DECODER]:
+            quantize_dynamic(model_file(model_dir, part, False), model_file(model_dir, part, True),
+                             weight_type=QuantType.QInt8)
+
+    tokenizer.save_pretrained(model_dir)
+    with open(os.path.join(model_dir, CONFIG_NAME), 'w', encoding='utf-8') as f:
+        json.dump({'model_name': model_name,
+                   'decoder_start_token_id': model.config.decoder_start_token_id,
+                   'eos_token_id': model.config.eos_token_id,
+                   'pad_token_id': model.config.pad_token_id}, f, indent=1)
+    return model_dir
+
+
+@functools.lru_cache(maxsize=None)
+def load_session(path, intra_op_num_threads=0, inter_op_num_threads=0):
+    """
+    Creates an ONNX Runtime CPU session. Sessions are cached per file and thread configuration, so repeated calls
+    (e.g. one answer function per question type) share the same session.
+
+    :param intra_op_num_threads: threads used within an operator, 0 lets ONNX Runtime choose
+    :param inter_op_num_threads: threads used across operators, 0 lets ONNX Runtime choose
+    """
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = intra_op_num_threads
+    options.inter_op_num_threads = inter_op_num_threads
+    return ort.InferenceSession(path, sess_options=options, providers=['CPUExecutionProvider'])
+
+
+class OnnxSeq2SeqModel:
+    """
+    Greedy text2text-generation with the encoder and decoder sessions of export_model.
+    """
+
+    def __init__(self, model_dir, *, quantized=True, intra_op_num_threads=0, inter_op_num_threads=0):
+        with open(os.path.join(model_dir, CONFIG_NAME), encoding='utf-8') as f:
+            config = json.load(f)
+        self.decoder_start_token_id = config['decoder_start_token_id']
+        self.eos_token_id = config['eos_token_id']
+        self.pad_token_id = config['pad_token_id']
+        self.encoder = load_session(os.path.abspath(model_file(model_dir, ENCODER, quantized)),
+                                    intra_op_num_threads, inter_op_num_threads)
+        self.decoder = load_session(os.path.abspath(model_file(model_dir, DECODER, quantized)),
+                                    intra_op_num_threads, inter_op_num_threads)
+
+    def encode(self, input_ids, attention_mask):
+        return self.encoder.run(None, {'input_ids': input_ids, 'attention_mask': attention_mask})[0]
+
+    def decoder_logits(self, decoder_input_ids, encoder_hidden_states, attention_mask):
+        return self.decoder.run(None, {'decoder_input_ids': decoder_input_ids,
+                                       'encoder_hidden_states': encoder_hidden_states,
+                                       'attention_mask': attention_mask})[0]
+
+    def sequence_logits(self, input_ids, attention_mask, sequences):
+        """
+        :return: logits (batch, sequences, longest sequence, vocabulary) of the answer sequences with teacher
+        forcing, see Inference.sequence_logits
+        """
+        input_ids = np.asarray(input_ids, dtype=np.int64)
+        attention_mask = np.asarray(attention_mask, dtype=np.int64)
+        decoder_input_ids = inference.decoder_inputs(sequences, self.decoder_start_token_id, self.pad_token_id)
+        encoder_hidden_states = self.encode(input_ids, attention_mask)
+        logits = self.decoder_logits(np.tile(decoder_input_ids, (len(input_ids), 1)),
+                                     np.repeat(encoder_hidden_states, len(sequences), axis=0),
+                                     np.repeat(attention_mask, len(sequences), axis=0))
+        return logits.reshape(len(input_ids), len(sequences), *logits.shape[1:])
+
+    def generate(self, input_ids, attention_mask, *, max_new_tokens=10):
+        """
+        :param input_ids: int64 array (batch, sequence)
+        :param attention_mask: int64 array (batch, sequence)
+        :return: int64 array of the decoder start token followed by the generated ids, padded after eos
+        """
+        input_ids = np.asarray(input_ids, dtype=np.int64)
+        attention_mask = np.asarray(attention_mask, dtype=np.int64)
+        encoder_hidden_states = self.encode(input_ids, attention_mask)
+
+        output = np.full((len(input_ids), 1), self.decoder_start_token_id, dtype=np.int64)
+        finished = np.zeros(len(input_ids), dtype=bool)
+        for _ in range(max_new_tokens):
+            logits = self.decoder_logits(output, encoder_hidden_states, attention_mask)[:, -1]
+            next_ids = np.where(finished, self.pad_token_id, logits.argmax(axis=-1))
+            output = np.concatenate([output, next_ids[:, None]], axis=1)
+            finished |= next_ids == self.eos_token_id
+            if finished.all():
+                break
+        return output
+
+
+def load_model(model_dir, *, quantized=True, intra_op_num_threads=0, inter_op_num_threads=0):
+    """
+    Loads an exported model, see export_model.
+
+    :return: OnnxSeq2SeqModel and tokenizer
+    """
+    model = OnnxSeq2SeqModel(model_dir, quantized=quantized, intra_op_num_threads=intra_op_num_threads,
+                             inter_op_num_threads=inter_op_num_threads)
+    return model, AutoTokenizer.from_pretrained(model_dir)
+
+
+def make_answer_function(model, tokenizer, **kwargs):
+    """
+    :param model: OnnxSeq2SeqModel
+    :return: function answering a list of questions, see Inference.answer_questions
+    """
+    return inference.make_answer_function(model, tokenizer, generate=model.generate, **kwargs)
+
+
+def make_token_answer_function(model, tokenizer, **kwargs):
+    """
+    :param model: OnnxSeq2SeqModel
+    :return: function answering rows of a TokenCache, see Inference.answer_token_cache
+    """
+    return inference.make_token_answer_function(model, tokenizer, generate=model.generate, **kwargs)
+
+
+def check_parity(df, question_type, reference_function, candidate_function, *, tolerance=0.01):
+    """
+    Answers the same questions with a reference backend (e.g. the full precision PyTorch model) and a candidate
+    backend (e.g. the int8 ONNX model) and compares their results with the ResultEvaluator.
+
+    :param df: questions in the layout of Generator.generate_questions
+    :param question_type: question type of df
+    :param reference_function: answer function of the reference backend, see Inference.make_answer_function
+    :param candidate_function: answer function of the candidate backend, see make_answer_function
+    :param tolerance: maximal absolute difference of the correct_percentage
+    :return: DataFrame with one row per backend (size, valid_answer, correct_answer, percentages, seconds and the
+    share of processed answers equal to the reference) and whether the difference is within the tolerance
+    """
+    results = []
+    answered = {}
+    for backend, answer_function in [('reference', reference_function), ('candidate', candidate_function)]:
+        answered[backend] = ev.score_answers(inference.answer_question_df(df, question_type, answer_function),
+                                             question_type)
+        result = ev.aggregate_results(answered[backend]).assign(backend=backend)
+        result['seconds'] = answered[backend][f'{question_type}_time'].iloc[0]
+        results.append(result)
+
+    model_an = f'{question_type}_model_an'
+    agreement = (answered['reference'][model_an].astype(str) == answered['candidate'][model_an].astype(str)).mean()
+    parity = pd.concat(results, ignore_index=True)
+    parity['agreement'] = [1.0, agreement]
+    difference = abs(parity[ev.CORRECT_PERCENTAGE].iloc[1] - parity[ev.CORRECT_PERCENTAGE].iloc[0])
+    return parity, bool(difference <= tolerance)
@@ -0,0 +1,492 @@
+import functools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+import TKGQuestionGenerator.Datasets as datasets
+import TKGQuestionGenerator.FactTable as ft
+import TKGQuestionGenerator.Generator as qm
+import TKGQuestionGenerator.HelperUtils as helper
+import TKGQuestionGenerator.Report as report
+import TKGQuestionGenerator.ResultEvaluator as ev
+import TKGQuestionGenerator.ResultsWarehouse as warehouse
+import TKGQuestionGenerator.Sampling as sampling
+
+logger = logging.getLogger(__name__)
+
+# marks the end of a stream between two stages
+STOP = None
+# model name in the results warehouse of runs with an injected answer function and without model_name
+UNKNOWN_MODEL = 'unknown'
+
+DEFAULT_CONFIG = {'dataset': 'dataset',
+                  'version': 'v1',
+                  'question_types': {'yes_no': {}, 'when': {}},
+                  'batch_size': 32,
+                  'queue_size': 8,
+                  'max_new_tokens': 10,
+                  'limit': None,
+                  'budget': None,
+                  'time_budget': None,
+                  'sec_per_100_qe': None,
+                  'throughput_results': None,
+                  'random_state': None,
+                  'confidence_level': None,
+                  'adaptive_robust': False,
+                  'questions_per_entity': 1,
+                  'output_dir': 'pipeline_output',
+                  'warehouse': None}
+
+
+def load_config(path):
+    """
+    Loads a JSON pipeline config. Relative paths are resolved against the directory of the config file.
+
+    Example:
+    {
+        "facts": "data/Cleansed_YAGO11k.csv",
+        "dataset": "YAGO11k",
+        "source_format": "YAGO11k",
+        "model": "bigscience/T0_3B",
+        "version": "v3",
+        "question_types": {"yes_no": {"lemma": false}, "when": {"time_indication": true}},
+        "batch_size": 32,
+        "output_dir": "results/pipeline",
+        "warehouse": "results/results.sqlite"
+    }
+
+    Sampling mode: with a budget (number of facts) or a time_budget (seconds of model time, converted with the measured
+    throughput sec_per_100_qe or the one of a results CSV throughput_results into questions and with the questions per
+    fact of a pilot sample into facts) only a sample of the facts, stratified by question type and predicate, is turned
+    into questions, see Sampling.sample_fact_rows. The results then estimate the correct_percentage of the complete
+    run, confidence_level such as 0.95 adds its confidence interval. Sampled runs are stored in the warehouse next to
+    the complete runs.
+
+    Adaptive mode: with adaptive_robust the yes_no_robust questions of an entity are only asked until one of them is
+    answered incorrectly, questions_per_entity at a time, see Inference.answer_yes_no_robust_adaptive. The cancelled
+    questions are not evaluated, correctly_answered_entities stays the same as if every question had been answered.
+
+    source_format is optional and names the adapter of Datasets.DATASETS the facts are read with. Such sources are
+    cached as fact store in cache_dir (defaults to Datasets.DEFAULT_CACHE_DIR).
+
+    :return: config dict completed with DEFAULT_CONFIG
+    """
+    with open(path, encoding='utf-8') as f:
+        config = {**DEFAULT_CONFIG, **json.load(f)}
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    for key in ['facts', 'output_dir', 'warehouse', 'cache_dir', 'throughput_results']:
+        if config.get(key) and not os.path.isabs(config[key]):
+            config[key] = os.path.join(base_dir, config[key])
+    if config.get('model'):
+        if os.path.exists(os.path.join(base_dir, config['model'])):
+            config['model'] = os.path.join(base_dir, config['model'])
+        config.setdefault('model_name', os.path.basename(os.path.normpath(config['model'])))
+    return config
+
+
+def generate_stage(fact_table, question_types, batch_size, out_queue, *, limit=None, rows=None):
+    """
+    Generates the questions of all question types fact by fact and emits batches of one question type.
+
+    :param question_types: dict question type -> keyword arguments of its formulate function
+    :param out_queue: receives (question type, list of (question, answer, predicate, qe_index)) and finally STOP
+    :param rows: Optional dict question type -> positional rows, e.g. of Sampling.sample_fact_rows. Only the
+    questions of those rows are generated, limit is then ignored.
+    """
+    buffers = {question_type: [] for question_type in question_types}
+    if rows is None:
+        n_rows = len(fact_table) if limit is None else min(limit, len(fact_table))
+        plan = ((row, list(question_types)) for row in range(n_rows))
+    else:
+        row_question_types = defaultdict(list)
+        for question_type, question_rows in rows.items():
+            for row in question_rows:
+                row_question_types[int(row)].append(question_type)
+        plan = sorted(row_question_types.items())
+
+    for row, row_question_types in plan:
+        subject, predicate, object, time_from, time_until = fact_table.decode_fact(row)
+        if time_from is None:
+            continue
+        for question_type in row_question_types:
+            temps = qm.formulate_questions(question_type, subject, predicate, object, time_from, time_until,
+                                           **question_types[question_type])
+            for question, answer in temps or []:
+                buffers[question_type].append((question, answer, predicate, fact_table.index[row]))
+            if len(buffers[question_type]) >= batch_size:
+                out_queue.put((question_type, buffers[question_type]))
+                buffers[question_type] = []
+
+    for question_type, batch in buffers.items():
+        if batch:
+            out_queue.put((question_type, batch))
+    out_queue.put(STOP)
+
+
+def infer_stage(in_queue, out_queue, answer_function, answer_functions=None, *, adaptive_robust=False,
+                questions_per_entity=1):
+    """
+    Answers the batches of the generate stage as they arrive.
+
+    :param out_queue: receives (question type, batch, model answers, seconds) and finally STOP. Cancelled questions
+    of the adaptive mode have a NaN model answer.
+    :param answer_functions: Optional dict question type -> answer function replacing answer_function
+    :param adaptive_robust: if True, yes_no_robust batches are answered with Inference.answer_yes_no_robust_adaptive.
+    A batch of generate_stage always holds all questions of its entities.
+    :param questions_per_entity: see Inference.answer_yes_no_robust_adaptive
+    """
+    answer_functions = answer_functions or {}
+    while True:
+        item = in_queue.get()
+        if item is STOP:
+            out_queue.put(STOP)
+            return
+        question_type, batch = item
+        function = answer_functions.get(question_type, answer_function)
+        start = time.time()
+        if adaptive_robust and question_type == 'yes_no_robust':
+            answers = answer_adaptive(batch, function, questions_per_entity)
+        else:
+            answers = function([question for question, _, _, _ in batch])
+        out_queue.put((question_type, batch, answers, time.time() - start))
+
+
+def answer_adaptive(batch, answer_function, questions_per_entity):
+    """
+    :return: model answers of a yes_no_robust batch, NaN for the cancelled questions
+    """
+    import TKGQuestionGenerator.Inference as inference
+
+    df = pd.DataFrame(batch, columns=['yes_no_robust_qe', 'yes_no_robust_an', 'predicate', 'qe_index'])
+    df, n_cancelled = inference.answer_yes_no_robust_adaptive(df, answer_function,
+                                                              questions_per_entity=questions_per_entity)
+    logger.debug('Cancelled %d of %d yes_no_robust questions', n_cancelled, len(df))
+    return df['yes_no_robust_model_an'].tolist()
+
+
+class StreamingEvaluator:
+    """
+    Scores answered batches as they arrive and keeps only counters per question type and predicate.
+    The evaluated questions are optionally written into the results warehouse batch by batch.
+
+    Questions of a sampled run are weighted with the SAMPLE_WEIGHT of their stratum, see Sampling.sample_fact_rows,
+    so correct_percentage estimates the one of the complete run.
+    """
+
+    def __init__(self, version, *, conn=None, dataset=None, model=None, sample_weights=None, confidence_level=None):
+        self.version = version
+        self.sample_weights = sample_weights
+        self.confidence_level = confidence_level
+        self.conn = conn
+        self.dataset = dataset
+        self.model = model
+        self.counts = defaultdict(lambda: [0, 0, 0])
+        self.time_processed = defaultdict(float)
+        self.entities = defaultdict(dict)
+        self.run_ids = {}
+        self.n_rows = defaultdict(int)
+
+    def add_batch(self, question_type, batch, answers, seconds):
+        # cancelled questions of the adaptive mode are not evaluated, like in ResultEvaluator.eval_yes_no_robust
+        answered = [(entry, model_an) for entry, model_an in zip(batch, answers) if not pd.isna(model_an)]
+        batch = [entry for entry, _ in answered]
+        answers = [model_an for _, model_an in answered]
+        model_answers, valid_answers, correct_answers = [], [], []
+        for (question, an, predicate, qe_index), model_an in zip(batch, answers):
+            _, valid, correct = ev.score_answer(question_type, an, model_an)
+            counts = self.counts[(question_type, predicate)]
+            counts[0] += 1
+            counts[1] += bool(valid)
+            counts[2] += bool(correct)
+            if question_type == 'yes_no_robust':
+                entities = self.entities[question_type]
+                entities[qe_index] = (entities.get(qe_index, (True,))[0] and bool(correct), predicate)
+            model_answers.append(model_an)
+            valid_answers.append(valid)
+            correct_answers.append(correct)
+        self.time_processed[question_type] += seconds
+
+        if self.conn is not None:
+            self.write_batch(question_type, batch, model_answers, valid_answers, correct_answers)
+
+    def write_batch(self, question_type, batch, model_answers, valid_answers, correct_answers):
+        if question_type not in self.run_ids:
+            self.run_ids[question_type] = warehouse.replace_run(self.conn, self.dataset, self.version, self.model,
+                                                                question_type, None,
+                                                                sampled=self.sample_weights is not None)
+        start = self.n_rows[question_type]
+        self.n_rows[question_type] += len(batch)
+        df = pd.DataFrame(batch, columns=[f'{question_type}_qe', f'{question_type}_an', 'predicate', 'qe_index'],
+                          index=pd.RangeIndex(start, start + len(batch)))
+        df[f'{question_type}_model_an'] = model_answers
+        df[ev.VALID_ANSWER] = valid_answers
+        df[ev.CORRECT_ANSWER] = correct_answers
+        confidences = helper.answer_confidences(model_answers)
+        if confidences is not None:
+            df[f'{question_type}_confidence'] = confidences
+        if self.sample_weights is not None:
+            df[ev.SAMPLE_WEIGHT] = [self.sample_weights.get((question_type, predicate), 1.0)
+                                    for predicate in df['predicate']]
+        warehouse.insert_questions(self.conn, self.run_ids[question_type], df, question_type)
+        self.conn.commit()
+
+    def finish(self):
+        if self.conn is not None:
+            with self.conn:
+                for question_type, run_id in self.run_ids.items():
+                    warehouse.finalize_run(self.conn, run_id, self.time_processed[question_type])
+
+    def results(self):
+        """
+        :return: results DataFrame in the format of result_to_df and predicate results in the long format of
+        aggregate_results
+        """
+        entity_counts = defaultdict(lambda: [0, 0])
+        for question_type, entities in self.entities.items():
+            for correct, predicate in entities.values():
+                counts = entity_counts[(question_type, predicate)]
+                counts[0] += 1
+                counts[1] += correct
+
+        rows = []
+        for (question_type, predicate), (size, valid, correct) in sorted(self.counts.items()):
+            # the weight is constant within a stratum, hence the counters suffice for the weighted estimate
+            weight = self.sample_weights.get((question_type, predicate), 1.0) if self.sample_weights else 1.0
+            entities, correct_entities = entity_counts.get((question_type, predicate), (0, 0))
+            rows.append((question_type, predicate, size, valid, correct, weight * size, weight ** 2 * size,
+                         weight * correct, entities, correct_entities, weight * entities, weight * correct_entities))
+        counts = pd.DataFrame(rows, columns=[ev.QUESTION_TYPE, 'predicate', *ev.COUNT_COLUMNS, *ev.WEIGHT_COLUMNS,
+                                             *ev.ENTITY_COUNT_COLUMNS, *ev.ENTITY_WEIGHT_COLUMNS])
+        predicate_results = ev.aggregate_counts(counts.drop(columns=[*ev.ENTITY_COUNT_COLUMNS,
+                                                                     *ev.ENTITY_WEIGHT_COLUMNS]),
+                                                (ev.QUESTION_TYPE, 'predicate'), confidence_level=self.confidence_level)
+
+        results = []
+        for _, entry in ev.aggregate_counts(counts, (ev.QUESTION_TYPE,),
+                                            confidence_level=self.confidence_level).iterrows():
+            question_type = entry[ev.QUESTION_TYPE]
+            result = {ev.QUESTION_TYPE: f'{question_type}_{self.version}',
+                      ev.SIZE: int(entry[ev.SIZE]),
+                      ev.VALID_ANSWER: int(entry[ev.VALID_ANSWER]),
+                      ev.CORRECT_ANSWER: int(entry[ev.CORRECT_ANSWER]),
+                      ev.TIME_PROCESSED: helper.sec_to_min(self.time_processed[question_type]),
+                      ev.CORRECT_PERCENTAGE: float(entry[ev.CORRECT_PERCENTAGE])}
+            if self.confidence_level:
+                for key in ev.CONFIDENCE_INTERVAL_COLUMNS[1:]:
+                    result[key] = entry[key]
+            if question_type == 'yes_no_robust':
+                result[ev.CORRECTLY_ANSWERED_ENTITIES] = int(entry[ev.CORRECTLY_ANSWERED_ENTITIES])
+                result[ev.CORRECTLY_ANSWERED_ENTITIES + '_percentage'] = float(
+                    entry[ev.CORRECTLY_ANSWERED_ENTITIES + '_percentage'])
+            results.append(result)
+
+        predicate_results[ev.QUESTION_TYPE] = predicate_results[ev.QUESTION_TYPE] + '_' + self.version
+        return pd.DataFrame(results), predicate_results
+
+
+def run_stage(target, args, errors, downstream):
+    """
+    Runs a stage and makes sure the downstream stage terminates if the stage fails.
+    """
+    try:
+        target(*args)
+    except Exception as e:
+        logger.exception('Stage %s failed', target.__name__)
+        errors.append(e)
+        downstream.put(STOP)
+
+
+def load_backend(config):
+    """
+    Loads the model of the config with its backend: 'torch' (default) or 'onnx' for a model exported with
+    OnnxInference.export_model. The ONNX backend reads the optional keys quantized (default true) and threads.
+
+    :return: backend module (Inference or OnnxInference), model and tokenizer
+    """
+    if config.get('backend', 'torch') == 'onnx':
+        import TKGQuestionGenerator.OnnxInference as onnx_inference
+        model, tokenizer = onnx_inference.load_model(config['model'], quantized=config.get('quantized', True),
+                                                     intra_op_num_threads=config.get('threads', 0))
+        return onnx_inference, model, tokenizer
+
+    import TKGQuestionGenerator.Inference as inference
+    model, tokenizer = inference.load_model(config['model'])
+    return inference, model, tokenizer
+
+
+def load_answer_functions(config, backend=None):
+    """
+    Loads the model of the config, see load_backend.
+
+    If yes_no_scoring is true, yes no questions are answered with Inference.score_yes_no instead of generation.
+
+    :param backend: Optional result of load_backend, so the model is only loaded once
+    :return: answer function and dict question type -> answer function of the question types answered differently
+    """
+    import TKGQuestionGenerator.Inference as inference
+
+    backend_module, model, tokenizer = backend or load_backend(config)
+    kwargs = {'batch_size': config['batch_size']}
+    answer_function = backend_module.make_answer_function(model, tokenizer, max_new_tokens=config['max_new_tokens'],
+                                                          **kwargs)
+
+    answer_functions = {}
+    if config.get('yes_no_scoring'):
+        scoring_function = inference.make_yes_no_scoring_function(model, tokenizer, **kwargs)
+        answer_functions = {'yes_no': scoring_function, 'yes_no_robust': scoring_function}
+    return answer_function, answer_functions
+
+
+def load_token_answer_function(config, question_type, backend):
+    """
+    :param backend: result of load_backend
+    :return: function answering rows of a TokenCache (see Inference.answer_token_cache) or None if the question
+    type is not answered by generation
+    """
+    if config.get('yes_no_scoring') and question_type in ('yes_no', 'yes_no_robust'):
+        return None
+    backend_module, model, tokenizer = backend
+    return backend_module.make_token_answer_function(model, tokenizer, batch_size=config['batch_size'],
+                                                     max_new_tokens=config['max_new_tokens'])
+
+
+def questions_per_fact(fact_table, question_types, rows, *, n_facts=50, random_state=None):
+    """
+    Measures the mean number of questions a fact yields per question type on a random pilot sample of facts.
+
+    :param question_types: dict question type -> keyword arguments of its formulate function
+    :param rows: positional rows to draw the pilot sample from
+    :param n_facts: size of the pilot sample
+    :return: dict question type -> mean number of questions per fact
+    """
+    rng = np.random.default_rng(random_state)
+    pilot = rng.choice(rows, size=min(n_facts, len(rows)), replace=False)
+    counts = {question_type: 0 for question_type in question_types}
+    for row in pilot:
+        subject, predicate, object, time_from, time_until = fact_table.decode_fact(row)
+        for question_type, kwargs in question_types.items():
+            counts[question_type] += len(qm.formulate_questions(question_type, subject, predicate, object, time_from,
+                                                                time_until, **kwargs) or [])
+    return {question_type: count / max(len(pilot), 1) for question_type, count in counts.items()}
+
+
+def sample_rows(config, fact_table):
+    """
+    Draws the facts of a sampled run if the config has a budget or a time_budget, see load_config.
+
+    :return: dict question type -> positional rows and dict (question type, predicate) -> SAMPLE_WEIGHT, or None and
+    None if the config does not sample
+    """
+    if config.get('budget') is None and config.get('time_budget') is None:
+        return None, None
+
+    n_rows = len(fact_table) if config.get('limit') is None else min(config['limit'], len(fact_table))
+    # facts without a year are skipped by the generation and therefore not part of the population
+    rows = np.flatnonzero(fact_table.time_from[:n_rows] != ft.MISSING_YEAR)
+
+    budgets = []
+    if config.get('budget') is not None:
+        budgets.append(config['budget'])
+    if config.get('time_budget') is not None:
+        sec_per_100_qe = config.get('sec_per_100_qe')
+        if sec_per_100_qe is None and config.get('throughput_results'):
+            sec_per_100_qe = sampling.sec_per_100_qe_from_results(pd.read_csv(config['throughput_results']))
+        if sec_per_100_qe is None:
+            raise ValueError('time_budget requires sec_per_100_qe or throughput_results in the config')
+        # the time budget is counted in questions, the sample in facts
+        n_questions = sampling.budget_for_time(config['time_budget'], sec_per_100_qe)
+        budgets.append(sampling.facts_for_questions(
+            n_questions, questions_per_fact(fact_table, config['question_types'], rows,
+                                            random_state=config.get('random_state'))))
+
+    sampled_rows, sample_weights = sampling.sample_fact_rows(fact_table, list(config['question_types']),
+                                                             min(budgets), rows=rows,
+                                                             random_state=config.get('random_state'))
+    logger.info('Sampled %d of %d facts per question type on average', sum(map(len, sampled_rows.values()))
+                // max(len(sampled_rows), 1), len(rows))
+    return sampled_rows, sample_weights
+
+
+def run_pipeline(config, answer_function=None):
+    """
+    Runs generate -> infer -> evaluate -> report.
+
+    The stages run concurrently and are connected by bounded queues: questions are answered while the generation is
+    still running and answers are scored as they arrive. Only the compact FactTable, at most queue_size batches per
+    queue and the counters of the evaluation are kept in memory.
+
+    :param config: config dict, see load_config
+    :param answer_function: Optional function answering a list of questions. If None the model of the config is
+    loaded, see load_answer_functions. The results are then stored under the model_name of the config or
+    UNKNOWN_MODEL.
+    :return: results DataFrame and predicate results DataFrame
+    """
+    answer_functions = {}
+    if answer_function is None:
+        answer_function, answer_functions = load_answer_functions(config)
+
+    if config.get('source_format'):
+        fact_table = datasets.load_dataset(config['source_format'], config['facts'], cache_dir=config.get('cache_dir'))
+    else:
+        fact_table = ft.read_fact_csv(config['facts'])
+    rows, sample_weights = sample_rows(config, fact_table)
+    question_queue = queue.Queue(maxsize=config['queue_size'])
+    answer_queue = queue.Queue(maxsize=config['queue_size'])
+    errors = []
+
+    generate = functools.partial(generate_stage, limit=config.get('limit'), rows=rows)
+    generate.__name__ = generate_stage.__name__
+    infer = functools.partial(infer_stage, adaptive_robust=config.get('adaptive_robust', False),
+                              questions_per_entity=config.get('questions_per_entity', 1))
+    infer.__name__ = infer_stage.__name__
+    stages = [threading.Thread(target=run_stage, daemon=True, name='generate',
+                               args=(generate, (fact_table, config['question_types'], config['batch_size'],
+                                                question_queue), errors, question_queue)),
+              threading.Thread(target=run_stage, daemon=True, name='infer',
+                               args=(infer, (question_queue, answer_queue, answer_function, answer_functions),
+                                     errors, answer_queue))]
+
+    conn = warehouse.connect(config['warehouse']) if config.get('warehouse') else None
+    try:
+        evaluator = StreamingEvaluator(config['version'], conn=conn, dataset=config['dataset'],
+                                       model=config.get('model_name', UNKNOWN_MODEL), sample_weights=sample_weights,
+                                       confidence_level=config.get('confidence_level'))
+
+        start = time.time()
+        for stage in stages:
+            stage.start()
+
+        first_result = True
+        while True:
+            item = answer_queue.get()
+            if item is STOP:
+                break
+            evaluator.add_batch(*item)
+            if first_result:
+                logger.info('First answers evaluated after %.1f sec', time.time() - start)
+                first_result = False
+
+        if errors:
+            raise errors[0]
+        evaluator.finish()
+    finally:
+        if conn is not None:
+            conn.close()
+
+    results_df, predicate_results_df = evaluator.results()
+    os.makedirs(config['output_dir'], exist_ok=True)
+    prefix = os.path.join(config['output_dir'], f"{config['dataset']}_{config['version']}")
+    results_df.to_csv(f'{prefix}_RESULTS.csv')
+    predicate_results_df.to_csv(f'{prefix}_RESULTS_BY_PREDICATE.csv')
+    report.render_report(results_df, config['output_dir'], predicate_results_df=predicate_results_df,
+                         name=f"{config['dataset']}_{config['version']}")
+    logger.info('Pipeline finished after %.1f sec', time.time() - start)
+    return results_df, predicate_results_df
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+import pandas as pd
+
+import TKGQuestionGenerator.ResultEvaluator as ev
+
+MANIFEST_NAME = 'report_manifest.json'
+PREDICATE = 'predicate'
+
+
+def fingerprint_data(*values) -> str:
+    """
+    :return: fingerprint of the data an artifact is rendered from
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for value in values:
+        if isinstance(value, pd.DataFrame):
+            value = value.to_csv()
+        digest.update(str(value).encode('utf-8'))
+        digest.update(b'\x1f')
+    return digest.hexdigest()
+
+
+def use_headless_backend():
+    """
+    Switches matplotlib to the non-interactive Agg backend, so rendering never blocks on a display.
+    """
+    matplotlib.use('Agg', force=True)
+
+
+def render_pie_chart_job(job):
+    qe_type, n_correct, size, file_path = job
+    ev.render_pie_chart(qe_type, n_correct, size, file_path, show=False)
+    return file_path
+
+
+def predicate_results_to_long(grouped_df):
+    """
+    Converts the wide results grouped by predicate (columns such as 'was born in_correct_answer', see
+    results/YAGO11k_ALL_V3_ANSWERS_GROUPED_BY_PREDICATE.csv) into the long format of
+    ResultEvaluator.aggregate_results with one row per question type and predicate.
+    """
+    rows = []
+    for _, entry in grouped_df.iterrows():
+        for size_column in entry.index[entry.index.str.endswith('_' + ev.SIZE)]:
+            predicate = size_column[:-len('_' + ev.SIZE)]
+            if pd.isna(entry[size_column]):
+                continue
+            rows.append({ev.QUESTION_TYPE: entry[ev.QUESTION_TYPE],
+                         PREDICATE: predicate,
+                         ev.SIZE: int(entry[size_column]),
+                         ev.VALID_ANSWER: int(entry[f'{predicate}_{ev.VALID_ANSWER}']),
+                         ev.CORRECT_ANSWER: int(entry[f'{predicate}_{ev.CORRECT_ANSWER}'])})
+    long_df = pd.DataFrame(rows)
+    long_df[ev.CORRECT_PERCENTAGE] = long_df[ev.CORRECT_ANSWER] / long_df[ev.SIZE]
+    return long_df
+
+
+def render_report(results_df, output_dir, *, predicate_results_df=None, name='results', processes=None,
+                  force=False):
+    """
+    Renders all artifacts of a report in one call:
+    - a pie chart per question type, rendered headless in a process pool
+    - LaTeX and Markdown tables of the results of all question types
+    - if predicate_results_df is given, LaTeX and Markdown tables of the correct percentage of every question type
+      and predicate
+
+    Artifacts whose underlying results did not change since the last call are not rendered again.
+    The fingerprints are kept in report_manifest.json within output_dir.
+
+    :param results_df: results such as results/YAGO11k_ALL_V3_RESULTS.csv or ResultEvaluator.result_to_df
+    :param output_dir: directory of the artifacts
+    :param predicate_results_df: Optional results per question type and predicate in the long format of
+    ResultEvaluator.aggregate_results or predicate_results_to_long
+    :param name: file name prefix of the tables
+    :param processes: number of processes rendering the charts, None for the number of CPUs
+    :param force: renders all artifacts even if they did not change
+    :return: list of the rendered artifact paths
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = {}
+    if os.path.exists(manifest_path) and not force:
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+
+    def is_outdated(file_path, fingerprint):
+        return force or manifest.get(os.path.basename(file_path)) != fingerprint or not os.path.exists(file_path)
+
+    rendered = []
+    fingerprints = {}
+
+    chart_jobs = []
+    for _, entry in results_df.iterrows():
+        qe_type = entry[ev.QUESTION_TYPE]
+        file_path = os.path.join(output_dir, f'{qe_type}.png')
+        fingerprint = fingerprint_data(qe_type, entry[ev.CORRECT_ANSWER], entry[ev.SIZE])
+        fingerprints[os.path.basename(file_path)] = fingerprint
+        if is_outdated(file_path, fingerprint):
+            chart_jobs.append((qe_type, int(entry[ev.CORRECT_ANSWER]), int(entry[ev.SIZE]), file_path))
+
+    tables = {f'{name}': results_df}
+    if predicate_results_df is not None:
+        tables[f'{name}_by_predicate'] = predicate_results_df.pivot(index=PREDICATE, columns=ev.QUESTION_TYPE,
+                                                                    values=ev.CORRECT_PERCENTAGE).reset_index()
+
+    for table_name, table in tables.items():
+        fingerprint = fingerprint_data(table)
+        for extension, render in [('tex', ev.generate_latex_table), ('md', ev.generate_markdown_table)]:
+            file_path = os.path.join(output_dir, f'{table_name}.{extension}')
+            fingerprints[os.path.basename(file_path)] = fingerprint
+            if is_outdated(file_path, fingerprint):
+                with open(file_path, 'w', encoding='utf-8') as f:
+                    f.write(render(table))
+                rendered.append(file_path)
+
+    if chart_jobs:
+        with ProcessPoolExecutor(max_workers=processes, initializer=use_headless_backend) as executor:
+            rendered.extend(executor.map(render_pie_chart_job, chart_jobs))
+
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({**manifest, **fingerprints}, f, indent=1)
+    return rendered
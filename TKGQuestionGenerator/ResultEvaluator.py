@@ -1,4 +1,9 @@
 import TKGQuestionGenerator.HelperUtils as helper
+import TKGQuestionGenerator.BinaryStore as store
+import TKGQuestionGenerator.ResultsWarehouse as warehouse
+import TKGQuestionGenerator.Sampling as sampling
+import TKGQuestionGenerator.WorkQueue as work_queue
+import os
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
@@ -9,246 +14,435 @@ TIME_PROCESSED = 'time_processed'
 CORRECT_PERCENTAGE = 'correct_percentage'
 QUESTION_TYPE = "question_type"
 SIZE = 'size'
-
-
-def eval_yes_no(df, version):
+SAMPLE_WEIGHT = sampling.SAMPLE_WEIGHT
+VERSION = 'version'
+MODEL = 'model'
+ENTITIES = 'entities'
+CORRECTLY_ANSWERED_ENTITIES = 'correctly_answered_entities'
+WEIGHT = 'weight'
+WEIGHT_SQUARED = 'weight_squared'
+WEIGHTED_CORRECT = 'weighted_correct'
+COUNT_COLUMNS = [SIZE, VALID_ANSWER, CORRECT_ANSWER]
+WEIGHT_COLUMNS = [WEIGHT, WEIGHT_SQUARED, WEIGHTED_CORRECT]
+ENTITY_WEIGHT = 'entity_weight'
+WEIGHTED_CORRECTLY_ANSWERED_ENTITIES = 'weighted_correctly_answered_entities'
+ENTITY_COUNT_COLUMNS = [ENTITIES, CORRECTLY_ANSWERED_ENTITIES]
+ENTITY_WEIGHT_COLUMNS = [ENTITY_WEIGHT, WEIGHTED_CORRECTLY_ANSWERED_ENTITIES]
+CONFIDENCE_INTERVAL_COLUMNS = [CORRECT_PERCENTAGE, CORRECT_PERCENTAGE + '_ci_low', CORRECT_PERCENTAGE + '_ci_high']
+
+
+def eval_yes_no(df, version, *, confidence_level=None):
     yes_no = ['yes_no_qe', 'yes_no_an', 'yes_no_model_an', 'yes_no_time', 'predicate']
 
     cur_columns = yes_no
     qe_name = f'yes_no_{version}'
-    an = cur_columns[1]
-    model_an = cur_columns[2]
 
-    df = df.loc[:, cur_columns]
+    df = select_columns(df, cur_columns)
     model_time = df[cur_columns[3]].iloc[0]
-    df = df.dropna()
-
-    df[model_an] = df[model_an].apply(
-        lambda x: helper.remove_unnecessary_model_answer_chars(x.lower()))
-
-    df[VALID_ANSWER] = df[model_an].apply(
-        lambda x: helper.is_yes_no(x))
+    df = score_answers(df.dropna(), 'yes_no')
+    df[qe_name + '_' + CORRECT_ANSWER] = df[CORRECT_ANSWER]
 
-    df[CORRECT_ANSWER] = df.apply(lambda x: helper.check_yes_no_correct(x[an], x[model_an]), axis=1)
-    df[qe_name + '_' + CORRECT_ANSWER] = df.apply(lambda x: helper.check_yes_no_correct(x[an], x[model_an]), axis=1)
-
-    results, predicate_results = get_results(df, qe_name, model_time)
+    results, predicate_results = get_results(df, qe_name, model_time, confidence_level=confidence_level)
     return results, predicate_results, df
 
 
-def eval_yes_no_robust(df, version, complete_interval):
+def eval_yes_no_robust(df, version, complete_interval, *, confidence_level=None):
     if complete_interval:
         qe_name = f'yes_no_robust_{version}_complete_interval'
     else:
         qe_name = f'yes_no_robust_{version}_single_value'
-    an = 'yes_no_robust_an'
-    model_an = 'yes_no_robust_model_an'
 
     model_time = df['yes_no_robust_time'].iloc[0]
-    df = df.dropna()
-
-    df[model_an] = df[model_an].apply(
-        lambda x: helper.remove_unnecessary_model_answer_chars(x.lower()))
-
-    df[VALID_ANSWER] = df[model_an].apply(
-        lambda x: helper.is_yes_no(x))
+    df = score_answers(df.dropna(), 'yes_no_robust')
+    df[qe_name + '_' + CORRECT_ANSWER] = df[CORRECT_ANSWER]
 
-    df[CORRECT_ANSWER] = df.apply(lambda x: helper.check_yes_no_correct(x[an], x[model_an]), axis=1)
-    df[qe_name + '_' + CORRECT_ANSWER] = df.apply(lambda x: helper.check_yes_no_correct(x[an], x[model_an]), axis=1)
-
-    correct_indices = get_indices_of_all_correctly_answered_questions(df)
+    correctly_answered_entities = count_correctly_answered_entities(df)
 
     print(qe_name)
-    return get_results_yes_no_robust(df, qe_name, len(correct_indices), model_time), df
+    return get_results_yes_no_robust(df, qe_name, correctly_answered_entities, model_time,
+                                     confidence_level=confidence_level), df
 
 
 def get_indices_of_all_correctly_answered_questions(df):
-    correct_indices = []
+    all_correct = df[CORRECT_ANSWER].astype(bool).groupby(df['qe_index']).transform('all')
+    correct = df[all_correct]
+    return correct.index.to_series().groupby(correct['qe_index'].to_numpy(), sort=True).agg(list).to_list()
+
 
-    for i, entry in df.groupby('qe_index'):
-        all_questions_correctly_answered = all(entry['correct_answer'])
-        if all_questions_correctly_answered:
-            correct_indices.append(entry['correct_answer'].index.to_list())
-    return correct_indices
+def count_correctly_answered_entities(df):
+    """
+    :return: number of entities (qe_index) whose questions were all answered correctly
+    """
+    return int(df[CORRECT_ANSWER].astype(bool).groupby(df['qe_index']).all().sum())
 
 
-def eval_when(df, version):
+def eval_when(df, version, *, confidence_level=None):
     when = ['when_qe', 'when_an', 'when_model_an', 'when_time', 'predicate']
 
     cur_columns = when
     qe_name = f'when_{version}'
-    an = cur_columns[1]
-    model_an = cur_columns[2]
 
-    df = df.loc[:, cur_columns]
+    df = select_columns(df, cur_columns)
     model_time = df[cur_columns[3]].iloc[0]
-    df = df.dropna()
-
-    df[model_an] = df[model_an].apply(
-        lambda x: helper.remove_unnecessary_model_answer_chars(x.lower()))
-
-    df[model_an] = df[model_an].apply(
-        lambda x: helper.extract_year(x))
+    df = score_answers(df.dropna(), 'when')
+    df[qe_name + '_' + CORRECT_ANSWER] = df[CORRECT_ANSWER]
 
-    df[VALID_ANSWER] = df[model_an].apply(
-        lambda x: helper.is_exactly_year(x))
-
-    df[CORRECT_ANSWER] = df.apply(lambda x: helper.check_if_an_in_interval(x[an], x[model_an], x[VALID_ANSWER]), axis=1)
-    df[qe_name + '_' + CORRECT_ANSWER] = df.apply(lambda x: helper.check_if_an_in_interval(x[an], x[model_an], x[VALID_ANSWER]), axis=1)
-
-    results, predicate_results = get_results(df, qe_name, model_time)
+    results, predicate_results = get_results(df, qe_name, model_time, confidence_level=confidence_level)
     return results, predicate_results, df
 
 
-def evaluate_left_open(df, version):
+def evaluate_left_open(df, version, *, confidence_level=None):
     left_open = ['left_open_qe', 'left_open_an', 'left_open_model_an', 'left_open_time', 'predicate']
 
-    return eval_left_or_right_open(df, left_open, f'left_open_{version}')
+    return eval_left_or_right_open(df, left_open, f'left_open_{version}', confidence_level=confidence_level)
 
 
-def evaluate_right_open(df, version):
+def evaluate_right_open(df, version, *, confidence_level=None):
     right_open = ['right_open_qe', 'right_open_an', 'right_open_model_an', 'right_open_time', 'predicate']
-    return eval_left_or_right_open(df, right_open, f'right_open_{version}')
+    return eval_left_or_right_open(df, right_open, f'right_open_{version}', confidence_level=confidence_level)
 
 
-def eval_left_or_right_open(df, cur_columns, qe_name):
-    an = cur_columns[1]
-    model_an = cur_columns[2]
+def eval_left_or_right_open(df, cur_columns, qe_name, *, confidence_level=None):
+    question_type = cur_columns[0][:-len('_qe')]
 
-    df = df.loc[:, cur_columns]
+    df = select_columns(df, cur_columns)
     model_time = df[cur_columns[3]].iloc[0]
-    df = df.dropna()
-
-    df[model_an] = df[model_an].apply(
-        lambda x: helper.remove_unnecessary_model_answer_chars(x.lower()))
+    df = score_answers(df.dropna(), question_type)
+    df[qe_name + '_' + CORRECT_ANSWER] = df[CORRECT_ANSWER]
 
-    df[model_an] = df[model_an].apply(
-        lambda x: helper.extract_year(x))
-
-    df[VALID_ANSWER] = df[model_an].apply(
-        lambda x: helper.is_exactly_year(x))
-
-    df[CORRECT_ANSWER] = df.apply(lambda x: helper.check_if_equal(x[an], x[model_an], x[VALID_ANSWER]), axis=1)
-    df[qe_name + '_' + CORRECT_ANSWER] = df.apply(lambda x: helper.check_if_equal(x[an], x[model_an], x[VALID_ANSWER]), axis=1)
-
-    results, predicate_results = get_results(df, qe_name, model_time)
+    results, predicate_results = get_results(df, qe_name, model_time, confidence_level=confidence_level)
     return results, predicate_results, df
 
 
-def eval_until_when(df, version, *, exact_answer=True):
+def eval_until_when(df, version, *, exact_answer=True, confidence_level=None):
     until_when = ['until_when_qe', 'until_when_an', 'until_when_model_an', 'until_when_time', 'predicate']
 
     cur_columns = until_when
     qe_name = f'until_when_{version}'
-    an = cur_columns[1]
-    model_an = cur_columns[2]
 
-    df = df.loc[:, cur_columns]
+    df = select_columns(df, cur_columns)
     model_time = df[cur_columns[3]].iloc[0]
-    df = df.dropna()
-
-    df[model_an] = df[model_an].apply(
-        lambda x: helper.remove_unnecessary_model_answer_chars(x.lower()))
-
-    df[model_an] = df[model_an].apply(
-        lambda x: helper.extract_year(x))
-
-    df[VALID_ANSWER] = df[model_an].apply(
-        lambda x: helper.is_exactly_year(x))
-
-    if exact_answer:
-        df[CORRECT_ANSWER] = df.apply(lambda x: helper.check_if_equal(x[an], x[model_an], x[VALID_ANSWER]), axis=1)
-        df[qe_name + '_' + CORRECT_ANSWER] = df.apply(lambda x: helper.check_if_equal(x[an], x[model_an], x[VALID_ANSWER]), axis=1)
-    else:
-        df[CORRECT_ANSWER] = df.apply(lambda x: helper.check_if_an_in_interval(x[an], x[model_an], x[VALID_ANSWER]),
-                                      axis=1)
-        df[qe_name + '_' + CORRECT_ANSWER] = df.apply(lambda x: helper.check_if_an_in_interval(x[an], x[model_an], x[VALID_ANSWER]),
-                                              axis=1)
+    df = score_answers(df.dropna(), 'until_when', exact_answer=exact_answer)
+    df[qe_name + '_' + CORRECT_ANSWER] = df[CORRECT_ANSWER]
 
-    results, predicate_results = get_results(df, qe_name, model_time)
+    results, predicate_results = get_results(df, qe_name, model_time, confidence_level=confidence_level)
     return results, predicate_results, df
 
 
-def eval_when_to_when(df, version):
+def eval_when_to_when(df, version, *, confidence_level=None):
     when_to_when = ['when_to_when_qe', 'when_to_when_an', 'when_to_when_model_an', 'when_to_when_time', 'predicate']
 
     cur_columns = when_to_when
     qe_name = f'when_to_when_{version}'
-    qe = cur_columns[0]
-    an = cur_columns[1]
-    model_an = cur_columns[2]
 
-    df = df.loc[:, cur_columns]
+    df = select_columns(df, cur_columns)
     model_time = df[cur_columns[3]].iloc[0]
-    df = df.dropna()
-
-    df[model_an] = df[model_an].apply(
-        lambda x: helper.remove_unnecessary_model_answer_chars(x.lower()))
-
-    df[model_an] = df[model_an].apply(
-        lambda x: helper.extract_two_years(x))
-
-    df[VALID_ANSWER] = df[model_an].apply(
-        lambda x: helper.has_two_entries(x))
-
-    df[CORRECT_ANSWER] = df.apply(lambda x: helper.check_if_first_and_last_equal(x[an], x[model_an], x[VALID_ANSWER]),
-                                  axis=1)
-    df[qe_name + '_' + CORRECT_ANSWER] = df.apply(lambda x: helper.check_if_first_and_last_equal(x[an], x[model_an], x[VALID_ANSWER]),
-                                  axis=1)
+    df = score_answers(df.dropna(), 'when_to_when')
+    df[qe_name + '_' + CORRECT_ANSWER] = df[CORRECT_ANSWER]
 
-    results, predicate_results = get_results(df, qe_name, model_time)
+    results, predicate_results = get_results(df, qe_name, model_time, confidence_level=confidence_level)
     return results, predicate_results, df
 
 
-def eval_duration(df, version):
+def eval_duration(df, version, *, confidence_level=None):
     duration = ['duration_qe', 'duration_an', 'duration_model_an', 'duration_time', 'predicate']
 
     cur_columns = duration
     qe_name = f'duration_{version}'
-    qe = cur_columns[0]
-    an = cur_columns[1]
-    model_an = cur_columns[2]
 
-    df = df.loc[:, cur_columns]
+    df = select_columns(df, cur_columns)
     model_time = df[cur_columns[3]].iloc[0]
-    df = df.dropna()
+    df = score_answers(df.dropna(), 'duration')
+    df[qe_name + '_' + CORRECT_ANSWER] = df[CORRECT_ANSWER]
+
+    results, predicate_results = get_results(df, qe_name, model_time, confidence_level=confidence_level)
+    return results, predicate_results, df
+
 
-    df[model_an] = df[model_an].apply(lambda x: helper.remove_unnecessary_model_answer_chars(x.lower()))
+def score_yes_no(an, model_an):
+    return model_an, helper.is_yes_no(model_an), helper.check_yes_no_correct(an, model_an)
 
-    df[VALID_ANSWER] = df[model_an].apply(lambda x: helper.has_duration(x))
 
-    df[model_an] = df.apply(lambda x: helper.extract_duration(x[model_an], x[VALID_ANSWER]), axis=1)
+def score_year_in_interval(an, model_an):
+    model_an = helper.extract_year(model_an)
+    valid = helper.is_exactly_year(model_an)
+    return model_an, valid, helper.check_if_an_in_interval(an, model_an, valid)
 
-    df[CORRECT_ANSWER] = df.apply(lambda x: helper.check_if_equal(x[an], x[model_an], x[VALID_ANSWER]), axis=1)
-    df[qe_name + '_' + CORRECT_ANSWER] = df.apply(lambda x: helper.check_if_equal(x[an], x[model_an], x[VALID_ANSWER]), axis=1)
 
-    results, predicate_results = get_results(df, qe_name, model_time)
+def score_exact_year(an, model_an):
+    model_an = helper.extract_year(model_an)
+    valid = helper.is_exactly_year(model_an)
+    return model_an, valid, helper.check_if_equal(an, model_an, valid)
+
+
+def score_two_years(an, model_an):
+    model_an = helper.extract_two_years(model_an)
+    valid = helper.has_two_entries(model_an)
+    return model_an, valid, helper.check_if_first_and_last_equal(an, model_an, valid)
+
+
+def score_duration(an, model_an):
+    valid = helper.has_duration(model_an)
+    model_an = helper.extract_duration(model_an, valid)
+    return model_an, valid, helper.check_if_equal(an, model_an, valid)
+
+
+SCORING_RULES = {'yes_no': score_yes_no,
+                 'yes_no_robust': score_yes_no,
+                 'when': score_year_in_interval,
+                 'left_open': score_exact_year,
+                 'right_open': score_exact_year,
+                 'until_when': score_exact_year,
+                 'when_to_when': score_two_years,
+                 'duration': score_duration}
+
+
+def scoring_rule(question_type, *, exact_answer=True):
+    """
+    :param exact_answer: if False, an until_when answer counts as correct if it lies within the interval of the
+    fact, like a when answer
+    :return: function (an, model_an) -> processed model answer, valid_answer, correct_answer of the question type
+    """
+    if question_type == 'until_when' and not exact_answer:
+        return score_year_in_interval
+    return SCORING_RULES[question_type]
+
+
+def score_answer(question_type, an, model_an, *, exact_answer=True):
+    """
+    Scores a single model answer. The eval functions score their DataFrames with the same rules, see score_answers,
+    hence answers evaluated as they arrive are scored exactly like answers evaluated all at once.
+
+    :param question_type: key of Generator.QUESTION_TYPES such as when or yes_no_robust
+    :param an: expected answer
+    :param model_an: raw model answer such as '<pad> 1992</s>'
+    :param exact_answer: see scoring_rule
+    :return: processed model answer, valid_answer, correct_answer
+    """
+    model_an = helper.remove_unnecessary_model_answer_chars(str(model_an).lower())
+    return scoring_rule(question_type, exact_answer=exact_answer)(an, model_an)
+
+
+def score_answers(df, question_type, *, exact_answer=True):
+    """
+    Scores the {question_type}_model_an column of a DataFrame with score_answer.
+
+    :return: copy of df whose model answers are processed like in the eval functions, with the valid_answer and
+    correct_answer columns
+    """
+    scores = [score_answer(question_type, an, model_an, exact_answer=exact_answer)
+              for an, model_an in zip(df[f'{question_type}_an'], df[f'{question_type}_model_an'])]
+    df = df.copy()
+    df[f'{question_type}_model_an'] = [processed for processed, _, _ in scores]
+    df[VALID_ANSWER] = [bool(valid) for _, valid, _ in scores]
+    df[CORRECT_ANSWER] = [bool(correct) for _, _, correct in scores]
+    return df
+
+
+def eval_top_k(df, question_type, version, *, ks=(1, 3, 5), confidence_level=None):
+    """
+    Evaluates ranked answers, see Inference.answer_ranked_df. A question counts as correct within the top k if one
+    of its k most likely candidates is correct, scored like the answers of the eval functions.
+
+    :param df: DataFrame with {question_type}_ranked, {question_type}_an, {question_type}_time and predicate
+    :param question_type: e.g. when, until_when or duration
+    :param ks: values of k, values larger than the number of ranked candidates are left out
+    :return: results dict with the top k accuracies, predicate results (of the top 1 answers) and the evaluated
+    DataFrame with the rank of the first correct candidate (NaN if none is correct)
+    """
+    qe_name = f'{question_type}_{version}_top_k'
+    an = f'{question_type}_an'
+    ranked = f'{question_type}_ranked'
+
+    df = select_columns(df, [f'{question_type}_qe', an, ranked, f'{question_type}_time', 'predicate'])
+    model_time = df[f'{question_type}_time'].iloc[0]
+    df = df.dropna()
+
+    def rank_of_correct_answer(entry):
+        for rank, (candidate, _) in enumerate(entry[ranked], start=1):
+            if score_answer(question_type, entry[an], f'<pad> {candidate}</s>')[2]:
+                return rank
+        return np.nan
+
+    df['rank_of_correct_answer'] = df.apply(rank_of_correct_answer, axis=1)
+    df[VALID_ANSWER] = df[ranked].apply(len) > 0
+    df[CORRECT_ANSWER] = df['rank_of_correct_answer'] == 1
+
+    results, predicate_results = get_results(df, qe_name, model_time, confidence_level=confidence_level)
+    ranked_k = int(df[ranked].apply(len).max()) if len(df) else 0
+    for k in [k for k in ks if k <= ranked_k]:
+        correct_within_k = int((df['rank_of_correct_answer'] <= k).sum())
+        results[f'top_{k}_{CORRECT_ANSWER}'] = correct_within_k
+        results[f'top_{k}_{CORRECT_PERCENTAGE}'] = correct_within_k / results[SIZE]
+    results['mean_reciprocal_rank'] = float((1 / df['rank_of_correct_answer']).fillna(0).mean())
     return results, predicate_results, df
 
 
-def get_results(df, question_type, time_processed, predicate=True):
+def select_columns(df, cur_columns):
+    """
+    Selects the columns of a question type and keeps the SAMPLE_WEIGHT column of sampled questions.
+    """
+    if SAMPLE_WEIGHT in df:
+        cur_columns = [*cur_columns, SAMPLE_WEIGHT]
+    return df.loc[:, cur_columns]
+
+
+def get_results(df, question_type, time_processed, predicate=True, *, confidence_level=None):
+    """
+    Sums up the valid and correct answers of an evaluated DataFrame overall and per predicate. Questions drawn by
+    Sampling are weighted with their SAMPLE_WEIGHT in correct_percentage, hence sampled runs report comparable
+    estimates of the complete run.
+
+    :param confidence_level: Optional confidence level such as 0.95. If provided, the Wilson confidence interval of
+    correct_percentage is added overall and per predicate.
+    :return: dict of the overall results and dict of the results per predicate
+    """
+    overall = aggregate_results(df, confidence_level=confidence_level).iloc[0]
     result = {'question_type': question_type,
-              'size': len(df),
-              VALID_ANSWER: sum(df[VALID_ANSWER]),
-              CORRECT_ANSWER: sum(df[CORRECT_ANSWER]),
+              'size': int(overall[SIZE]),
+              VALID_ANSWER: int(overall[VALID_ANSWER]),
+              CORRECT_ANSWER: int(overall[CORRECT_ANSWER]),
               'time_processed': helper.sec_to_min(time_processed)}
-    result['correct_percentage'] = result[CORRECT_ANSWER] / result['size']
+    result['correct_percentage'] = float(overall[CORRECT_PERCENTAGE])
+    if confidence_level:
+        for key in CONFIDENCE_INTERVAL_COLUMNS:
+            result[key] = overall[key]
 
     predicate_results = {}
     if predicate:
-        for i, entry in df.groupby('predicate'):
-            predicate_results[i + '_' + CORRECT_ANSWER] = sum(entry[CORRECT_ANSWER])
-            predicate_results[i + '_' + VALID_ANSWER] = sum(entry[VALID_ANSWER])
-            predicate_results[i + '_' + SIZE] = len(entry)
+        for _, entry in aggregate_results(df, ('predicate',), confidence_level=confidence_level).iterrows():
+            i = entry['predicate']
+            predicate_results[i + '_' + CORRECT_ANSWER] = int(entry[CORRECT_ANSWER])
+            predicate_results[i + '_' + VALID_ANSWER] = int(entry[VALID_ANSWER])
+            predicate_results[i + '_' + SIZE] = int(entry[SIZE])
+            if confidence_level:
+                for key in CONFIDENCE_INTERVAL_COLUMNS:
+                    predicate_results[i + '_' + key] = entry[key]
             predicate_results['question_type'] = question_type
     return result, predicate_results
 
 
-def get_results_yes_no_robust(df, question_type, correctly_answered_entities, time_processed, predicate=False):
-    result, predicate_results = get_results(df, question_type, time_processed, predicate)
+def aggregate_results(df, by=(), *, confidence_level=None, entity_column=None):
+    """
+    Aggregates evaluated questions in a single vectorized groupby.
+
+    As an example:
+    - by=('predicate',) -> one row per predicate
+    - by=('question_type', 'version', 'model', 'predicate') on the concatenated DataFrames of several runs, see
+      tag_evaluated, -> one row per run and predicate
+
+    :param df: evaluated DataFrame with the columns valid_answer and correct_answer
+    :param by: columns to group by, an empty tuple aggregates all questions into one row
+    :param confidence_level: Optional confidence level such as 0.95. Adds the Wilson confidence interval of
+    correct_percentage.
+    :param entity_column: Optional column such as qe_index. Adds the number of entities and the number of entities
+    whose questions were all answered correctly.
+    :return: tidy DataFrame with the by columns, size, valid_answer, correct_answer, valid_percentage and
+    correct_percentage, which is weighted with SAMPLE_WEIGHT if df has that column
+    """
+    keys = list(by) or ['_all']
+    if not by:
+        df = df.assign(_all=0)
+
+    columns = {SIZE: df[CORRECT_ANSWER].notna(),
+               VALID_ANSWER: df[VALID_ANSWER].astype(bool),
+               CORRECT_ANSWER: df[CORRECT_ANSWER].astype(bool)}
+    if SAMPLE_WEIGHT in df:
+        weights = df[SAMPLE_WEIGHT].astype(float)
+        columns[WEIGHT] = weights
+        columns[WEIGHT_SQUARED] = weights ** 2
+        columns[WEIGHTED_CORRECT] = weights * columns[CORRECT_ANSWER]
+
+    counts = pd.DataFrame(columns).groupby([df[column] for column in keys], sort=True, observed=True).sum()
+
+    if entity_column:
+        grouped = pd.DataFrame(columns).groupby([*(df[column] for column in keys), df[entity_column]], sort=True,
+                                                observed=True)
+        # all questions of an entity belong to one stratum and share its weight
+        entities = pd.DataFrame({ENTITIES: 1, CORRECTLY_ANSWERED_ENTITIES: grouped[CORRECT_ANSWER].all()})
+        if WEIGHT in columns:
+            entity_weights = grouped[WEIGHT].first()
+            entities[ENTITY_WEIGHT] = entity_weights
+            entities[WEIGHTED_CORRECTLY_ANSWERED_ENTITIES] = entity_weights * entities[CORRECTLY_ANSWERED_ENTITIES]
+        entities = entities.groupby(level=list(range(len(keys))), sort=True).sum()
+        for column in entities:
+            counts[column] = entities[column].to_numpy()
+
+    return aggregate_counts(counts.reset_index(), by, confidence_level=confidence_level)
+
+
+def aggregate_counts(counts, by=(), *, confidence_level=None):
+    """
+    Sums up answer counters and derives the percentages and confidence intervals of aggregate_results. Evaluations
+    that only keep counters, such as Pipeline.StreamingEvaluator, use it directly, hence their numbers match the
+    ones of aggregate_results.
+
+    :param counts: DataFrame with the by columns and the counters size, valid_answer and correct_answer. Weighted
+    counters additionally have weight, weight_squared and weighted_correct, the sums of the SAMPLE_WEIGHT of the
+    questions, of its square and of the SAMPLE_WEIGHT of the correct answers. entities and
+    correctly_answered_entities are optional, weighted with entity_weight and weighted_correctly_answered_entities.
+    :param by: columns to group by, an empty tuple sums up all rows
+    :param confidence_level: Optional confidence level such as 0.95. Adds the Wilson confidence interval of
+    correct_percentage, based on the effective sample size of weighted counters.
+    :return: tidy DataFrame with the by columns, the summed counters (without the weights) and their percentages
+    """
+    by = list(by)
+    if not by:
+        counts = counts.assign(_all=0)
+        by = ['_all']
+
+    summed = [column for column in [*COUNT_COLUMNS, *WEIGHT_COLUMNS, *ENTITY_COUNT_COLUMNS, *ENTITY_WEIGHT_COLUMNS]
+              if column in counts]
+    aggregated = counts.groupby(by, sort=True, observed=True)[summed].sum()
+    aggregated = aggregated.astype({SIZE: int, VALID_ANSWER: int, CORRECT_ANSWER: int})
+    aggregated['valid_percentage'] = aggregated[VALID_ANSWER] / aggregated[SIZE]
+
+    if WEIGHT in aggregated:
+        aggregated[CORRECT_PERCENTAGE] = aggregated[WEIGHTED_CORRECT] / aggregated[WEIGHT]
+        effective_size = aggregated[WEIGHT] ** 2 / aggregated[WEIGHT_SQUARED]
+        aggregated = aggregated.drop(columns=WEIGHT_COLUMNS)
+    else:
+        aggregated[CORRECT_PERCENTAGE] = aggregated[CORRECT_ANSWER] / aggregated[SIZE]
+        effective_size = aggregated[SIZE]
+
+    if confidence_level:
+        ci_low, ci_high = helper.wilson_interval(aggregated[CORRECT_PERCENTAGE].to_numpy(),
+                                                 effective_size.to_numpy(), confidence_level)
+        aggregated[CORRECT_PERCENTAGE + '_ci_low'] = ci_low
+        aggregated[CORRECT_PERCENTAGE + '_ci_high'] = ci_high
+
+    if ENTITIES in aggregated:
+        aggregated = aggregated.astype({ENTITIES: int, CORRECTLY_ANSWERED_ENTITIES: int})
+        if ENTITY_WEIGHT in aggregated:
+            aggregated[CORRECTLY_ANSWERED_ENTITIES + '_percentage'] = (
+                    aggregated[WEIGHTED_CORRECTLY_ANSWERED_ENTITIES] / aggregated[ENTITY_WEIGHT])
+            aggregated = aggregated.drop(columns=ENTITY_WEIGHT_COLUMNS)
+        else:
+            aggregated[CORRECTLY_ANSWERED_ENTITIES + '_percentage'] = (aggregated[CORRECTLY_ANSWERED_ENTITIES]
+                                                                       / aggregated[ENTITIES])
+
+    aggregated = aggregated.reset_index()
+    if by == ['_all']:
+        aggregated = aggregated.drop(columns='_all')
+    return aggregated
+
+
+def tag_evaluated(df, question_type, *, version=None, model=None):
+    """
+    Adds question_type, version and model columns to an evaluated DataFrame, so the evaluated DataFrames of several
+    runs can be concatenated and aggregated together with aggregate_results.
+    """
+    return df.assign(**{QUESTION_TYPE: question_type, VERSION: version, MODEL: model})
+
+
+def get_results_yes_no_robust(df, question_type, correctly_answered_entities, time_processed, predicate=False, *,
+                              confidence_level=None):
+    result, predicate_results = get_results(df, question_type, time_processed, predicate,
+                                            confidence_level=confidence_level)
     result['correctly_answered_entities'] = correctly_answered_entities
-    result['correct_percentage'] = result[CORRECT_ANSWER] / result['size']
-    result['correctly_answered_entities_percentage'] = correctly_answered_entities / len(df.groupby('qe_index'))
+    # weighted like correct_percentage
+    result['correctly_answered_entities_percentage'] = float(
+        aggregate_results(df, entity_column='qe_index')[CORRECTLY_ANSWERED_ENTITIES + '_percentage'].iloc[0])
     return result, predicate_results
 
 
@@ -256,23 +450,133 @@ def result_to_df(results_dict):
     return pd.DataFrame.from_dict(results_dict, orient='index').T
 
 
-def generate_pie_chart(result_df, path, qe_type=None):
+def generate_pie_chart(result_df, path, qe_type=None, *, show=True):
+    """
+    Draws a pie chart of the correct and incorrect answers for every row of a results DataFrame and saves it as
+    {path}{question_type}.png.
+
+    :param show: if False the charts are only saved, which does not block on machines without display
+    """
     for i, entry in result_df.iterrows():
-        if qe_type:
-            qe_type = qe_type
-        else:
-            qe_type = entry[QUESTION_TYPE]
-        n_cor_ans = entry[CORRECT_ANSWER]
-        n_incor_ans = entry[SIZE] - n_cor_ans
-        cor_percentage = round(entry[CORRECT_PERCENTAGE] * 100, 2)
+        render_pie_chart(qe_type or entry[QUESTION_TYPE], entry[CORRECT_ANSWER], entry[SIZE],
+                         f'{path}{qe_type or entry[QUESTION_TYPE]}.png', show=show)
 
-        y = np.array([n_cor_ans, n_incor_ans])
-        labels = ['Correct answers', 'Incorrect answers']
 
-        plt.pie(y, labels=labels, autopct='%1.2f%%')
-        plt.title(f"{helper.remove_underline_and_capitalise(qe_type)}")
-        plt.savefig(f'{path}{qe_type}.png')
-        plt.show()
+def render_pie_chart(qe_type, n_cor_ans, size, file_path, *, show=False):
+    n_incor_ans = size - n_cor_ans
 
-def generate_latex_table(df):
-    pass
\ No newline at end of file
+    y = np.array([n_cor_ans, n_incor_ans])
+    labels = ['Correct answers', 'Incorrect answers']
+
+    fig, ax = plt.subplots()
+    ax.pie(y, labels=labels, autopct='%1.2f%%')
+    ax.set_title(f"{helper.remove_underline_and_capitalise(qe_type)}")
+    fig.savefig(file_path)
+    if show:
+        plt.show()
+    plt.close(fig)
+
+
+def generate_latex_table(df, *, caption=None, label=None, float_format='{:.4f}'):
+    """
+    Converts a results DataFrame into a LaTeX table.
+
+    :param df: DataFrame such as the results of result_to_df or aggregate_results
+    :param caption: Optional caption of the table
+    :param label: Optional label of the table
+    :param float_format: format of float values
+    :return: LaTeX code of the table
+    """
+    columns = [helper.escape_latex(helper.remove_underline_and_capitalise(str(column))) for column in df.columns]
+    lines = ['\\begin{table}[ht]',
+             '\\centering',
+             '\\begin{tabular}{' + 'l' * len(df.columns) + '}',
+             '\\hline',
+             ' & '.join(columns) + ' \\\\',
+             '\\hline']
+    for row in df.itertuples(index=False):
+        cells = [helper.escape_latex(format_cell(value, float_format)) for value in row]
+        lines.append(' & '.join(cells) + ' \\\\')
+    lines.append('\\hline')
+    lines.append('\\end{tabular}')
+    if caption:
+        lines.append(f'\\caption{{{helper.escape_latex(caption)}}}')
+    if label:
+        lines.append(f'\\label{{{label}}}')
+    lines.append('\\end{table}')
+    return '\n'.join(lines) + '\n'
+
+
+def generate_markdown_table(df, *, float_format='{:.4f}'):
+    """
+    Converts a results DataFrame into a Markdown table.
+    """
+    columns = [helper.remove_underline_and_capitalise(str(column)) for column in df.columns]
+    lines = ['| ' + ' | '.join(columns) + ' |',
+             '|' + '---|' * len(columns)]
+    for row in df.itertuples(index=False):
+        cells = [format_cell(value, float_format).replace('|', '\\|') for value in row]
+        lines.append('| ' + ' | '.join(cells) + ' |')
+    return '\n'.join(lines) + '\n'
+
+
+def format_cell(value, float_format):
+    if pd.isna(value):
+        return '-'
+    if isinstance(value, (float, np.floating)):
+        return float_format.format(value)
+    return str(value)
+
+
+def read_question_store(path, start=0, stop=None):
+    """
+    Reads a slice of a question store written by BinaryStore.save_questions without loading the whole store.
+    The returned DataFrame can be passed to the eval functions.
+    """
+    with store.BinaryStore(path) as question_store:
+        return store.read_questions(question_store, start, stop)
+
+
+def merge_answer_chunks(work_dir):
+    """
+    Merges the answered chunks of a distributed run (see WorkQueue.run_worker) into one DataFrame in the order of
+    the question store. {question_type}_time holds the summed up time of all chunks.
+    The returned DataFrame can be passed to the eval functions.
+
+    Raises a ValueError if a chunk is not answered yet or was answered for another question store.
+    """
+    queue = work_queue.load_queue(work_dir)
+    question_type = queue['question_type']
+    missing = [chunk for chunk in range(len(queue['chunks']))
+               if not os.path.exists(work_queue.answer_path(work_dir, chunk))]
+    if missing:
+        raise ValueError(f'{len(missing)} of {len(queue["chunks"])} chunks are not answered yet, e.g. {missing[:5]}')
+
+    chunks = []
+    for chunk, (start, stop) in enumerate(queue['chunks']):
+        with store.BinaryStore(work_queue.answer_path(work_dir, chunk)) as answer_store:
+            if answer_store.attributes.get('fingerprint') != queue['fingerprint']:
+                raise ValueError(f'Chunk {chunk} was answered for another question store than the one of the queue')
+            df = store.read_questions(answer_store)
+        df.index = pd.RangeIndex(start, stop)
+        chunks.append(df)
+    df = pd.concat(chunks)
+    df[f'{question_type}_time'] = sum(chunk[f'{question_type}_time'].iloc[0] for chunk in chunks if len(chunk))
+    return df
+
+
+def save_to_warehouse(conn, df, qe_name, *, dataset, model):
+    """
+    Writes an evaluated DataFrame into the results warehouse.
+
+    :param conn: connection, see ResultsWarehouse.connect
+    :param df: DataFrame returned by an eval function
+    :param qe_name: question_type of the results of the eval function such as when_v3
+    :param dataset: e.g. YAGO11k
+    :param model: e.g. T0pp
+    :return: run_id
+    """
+    question_type, version = warehouse.split_run_name(qe_name)
+    column_prefix = warehouse.RUN_NAME_PATTERN.match(qe_name).group('question_type')
+    return warehouse.write_run(conn, df, dataset=dataset, version=version, model=model,
+                               question_type=question_type, column_prefix=column_prefix)
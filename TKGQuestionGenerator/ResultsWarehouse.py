@@ -0,0 +1,325 @@
+import json
+import re
+import sqlite3
+
+import pandas as pd
+
+import TKGQuestionGenerator.HelperUtils as helper
+import TKGQuestionGenerator.Sampling as sampling
+
+RUNS_TABLE = '''
+CREATE TABLE IF NOT EXISTS {name} (
+    run_id INTEGER PRIMARY KEY,
+    dataset TEXT NOT NULL,
+    version TEXT NOT NULL,
+    model TEXT NOT NULL,
+    question_type TEXT NOT NULL,
+    sampled INTEGER NOT NULL DEFAULT 0,
+    time_processed REAL,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (dataset, model, version, question_type, sampled)
+);
+'''
+
+# weight and weighted_correct are the sums of the SAMPLE_WEIGHT (1 for complete runs) of all and of the correctly
+# answered questions, hence weighted_correct / weight estimates the correct_percentage of a complete run
+SCHEMA = RUNS_TABLE.format(name='runs') + '''
+CREATE INDEX IF NOT EXISTS runs_question_type ON runs (question_type, dataset, model, version);
+
+CREATE TABLE IF NOT EXISTS questions (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id) ON DELETE CASCADE,
+    row_index INTEGER NOT NULL,
+    qe_index INTEGER,
+    predicate TEXT NOT NULL,
+    question TEXT,
+    answer TEXT,
+    model_answer TEXT,
+    valid_answer INTEGER NOT NULL,
+    correct_answer INTEGER NOT NULL,
+    sample_weight REAL,
+    confidence REAL,
+    PRIMARY KEY (run_id, row_index)
+);
+CREATE INDEX IF NOT EXISTS questions_predicate ON questions (run_id, predicate, correct_answer, valid_answer);
+CREATE INDEX IF NOT EXISTS questions_qe_index ON questions (qe_index, run_id);
+
+CREATE TABLE IF NOT EXISTS predicate_results (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id) ON DELETE CASCADE,
+    predicate TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    valid_answer INTEGER NOT NULL,
+    correct_answer INTEGER NOT NULL,
+    weight REAL,
+    weighted_correct REAL,
+    PRIMARY KEY (run_id, predicate)
+);
+CREATE INDEX IF NOT EXISTS predicate_results_predicate ON predicate_results (predicate, run_id);
+'''
+
+# run name of the eval functions such as when_v3 or yes_no_robust_v1_complete_interval
+RUN_NAME_PATTERN = re.compile(r'^(?P<question_type>.+?)_(?P<version>v\d+)(?P<suffix>_.+)?$')
+
+ALL_PREDICATES = '__all__'
+
+CORRECT_PERCENTAGE = 'COALESCE(p.weighted_correct / p.weight, CAST(p.correct_answer AS REAL) / p.size)'
+
+
+def connect(path):
+    """
+    Opens (and creates if necessary) a results warehouse.
+
+    :param path: path of the SQLite file, ':memory:' for an in-memory warehouse
+    :return: sqlite3 connection
+    """
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA foreign_keys = ON')
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.executescript(SCHEMA)
+    migrate(conn)
+    return conn
+
+
+def migrate(conn):
+    """
+    Upgrades a warehouse created before sampled runs were stored next to complete runs.
+    """
+    if 'sampled' not in table_columns(conn, 'runs'):
+        # the unique key of runs changes, which requires rebuilding the table
+        conn.execute('PRAGMA foreign_keys = OFF')
+        with conn:
+            conn.execute(RUNS_TABLE.format(name='runs_new'))
+            conn.execute('INSERT INTO runs_new (run_id, dataset, version, model, question_type, time_processed, '
+                         'created_at) SELECT run_id, dataset, version, model, question_type, time_processed, '
+                         'created_at FROM runs')
+            conn.execute('DROP TABLE runs')
+            conn.execute('ALTER TABLE runs_new RENAME TO runs')
+        conn.execute('PRAGMA foreign_keys = ON')
+    for table, column in [('questions', 'sample_weight'), ('questions', 'confidence'),
+                          ('predicate_results', 'weight'), ('predicate_results', 'weighted_correct')]:
+        if column not in table_columns(conn, table):
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} REAL')
+    conn.executescript(SCHEMA)
+
+
+def table_columns(conn, table):
+    return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+
+def split_run_name(name):
+    """
+    Splits a run name of the eval functions into question type and version.
+
+    As an example:
+    - when_v3 -> when, v3
+    - yes_no_robust_v1_complete_interval -> yes_no_robust_complete_interval, v1
+    """
+    m = RUN_NAME_PATTERN.match(name)
+    if not m:
+        raise ValueError(f'{name} does not contain a version such as _v1')
+    return m.group('question_type') + (m.group('suffix') or ''), m.group('version')
+
+
+def replace_run(conn, dataset, version, model, question_type, time_processed, *, sampled=False):
+    """
+    Deletes an existing run with the same key and inserts a new one.
+
+    :param sampled: True for the runs of sampled questions, which are kept next to the complete run of the same
+    dataset, model, version and question type
+    :return: run_id
+    """
+    conn.execute('DELETE FROM runs WHERE dataset = ? AND model = ? AND version = ? AND question_type = ? '
+                 'AND sampled = ?', (dataset, model, version, question_type, int(sampled)))
+    cursor = conn.execute('INSERT INTO runs (dataset, version, model, question_type, sampled, time_processed) '
+                          'VALUES (?, ?, ?, ?, ?, ?)',
+                          (dataset, version, model, question_type, int(sampled), time_processed))
+    return cursor.lastrowid
+
+
+def write_run(conn, df, *, dataset, version, model, question_type, time_processed=None, column_prefix=None,
+              sampled=None):
+    """
+    Writes an evaluated DataFrame of one question type into the warehouse. A previous run with the same
+    dataset, model, version and question type is replaced, sampled and complete runs are kept apart.
+
+    :param conn: connection, see connect
+    :param df: DataFrame returned by one of the eval functions of the ResultEvaluator
+    :param dataset: e.g. YAGO11k
+    :param version: e.g. v3
+    :param model: e.g. T0pp
+    :param question_type: e.g. when or yes_no_robust_complete_interval
+    :param time_processed: seconds the model needed. Taken from {column_prefix}_time if None.
+    :param column_prefix: prefix of the question columns of df such as yes_no_robust, defaults to question_type
+    :param sampled: whether df holds sampled questions, defaults to whether df has a SAMPLE_WEIGHT column
+    :return: run_id
+    """
+    column_prefix = column_prefix or question_type
+    if sampled is None:
+        sampled = sampling.SAMPLE_WEIGHT in df
+    if time_processed is None and f'{column_prefix}_time' in df and len(df):
+        time_processed = float(df[f'{column_prefix}_time'].iloc[0])
+
+    with conn:
+        run_id = replace_run(conn, dataset, version, model, question_type, time_processed, sampled=sampled)
+        insert_questions(conn, run_id, df, column_prefix)
+        finalize_run(conn, run_id)
+    return run_id
+
+
+def insert_questions(conn, run_id, df, column_prefix):
+    """
+    Appends evaluated questions to a run. Allows writing a run batch by batch, see finalize_run.
+    """
+    def column(name):
+        if name not in df:
+            return [None] * len(df)
+        return [value if value is None or isinstance(value, str) else json.dumps(value, default=int)
+                for value in df[name]]
+
+    qe_index = df['qe_index'].astype('Int64').tolist() if 'qe_index' in df else [None] * len(df)
+    def float_column(name):
+        return df[name].astype(float).tolist() if name in df else [None] * len(df)
+
+    rows = zip(df.index.tolist(), qe_index, df['predicate'].tolist(),
+               column(f'{column_prefix}_qe'), column(f'{column_prefix}_an'), column(f'{column_prefix}_model_an'),
+               df['valid_answer'].astype(int).tolist(), df['correct_answer'].astype(int).tolist(),
+               float_column(sampling.SAMPLE_WEIGHT), float_column(f'{column_prefix}_confidence'))
+    conn.executemany('INSERT INTO questions (run_id, row_index, qe_index, predicate, question, answer, '
+                     'model_answer, valid_answer, correct_answer, sample_weight, confidence) '
+                     'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                     ((run_id, *row) for row in rows))
+
+
+def finalize_run(conn, run_id, time_processed=None):
+    """
+    Computes the per predicate results of a run from its questions.
+    """
+    if time_processed is not None:
+        conn.execute('UPDATE runs SET time_processed = ? WHERE run_id = ?', (time_processed, run_id))
+    conn.execute('DELETE FROM predicate_results WHERE run_id = ?', (run_id,))
+    sums = ('COUNT(*), SUM(valid_answer), SUM(correct_answer), SUM(COALESCE(sample_weight, 1)), '
+            'SUM(COALESCE(sample_weight, 1) * correct_answer)')
+    conn.execute('INSERT INTO predicate_results (run_id, predicate, size, valid_answer, correct_answer, weight, '
+                 f'weighted_correct) SELECT run_id, predicate, {sums} FROM questions WHERE run_id = ? '
+                 'GROUP BY predicate', (run_id,))
+    conn.execute('INSERT INTO predicate_results (run_id, predicate, size, valid_answer, correct_answer, weight, '
+                 f'weighted_correct) SELECT run_id, ?, {sums} FROM questions WHERE run_id = ?',
+                 (ALL_PREDICATES, run_id))
+
+
+def import_results_csv(conn, results_path, *, dataset, model, grouped_by_predicate_path=None):
+    """
+    Imports the results CSVs written before the warehouse existed, e.g. results/YAGO11k_ALL_V3_RESULTS.csv and
+    results/YAGO11k_ALL_V3_ANSWERS_GROUPED_BY_PREDICATE.csv. Those runs have no per question rows.
+
+    :return: list of run_ids
+    """
+    results = pd.read_csv(results_path, index_col=0)
+    grouped = None
+    if grouped_by_predicate_path:
+        grouped = pd.read_csv(grouped_by_predicate_path, index_col=0).set_index('question_type')
+
+    run_ids = []
+    with conn:
+        for _, entry in results.iterrows():
+            question_type, version = split_run_name(entry['question_type'])
+            run_id = replace_run(conn, dataset, version, model, question_type,
+                                 helper.min_sec_to_sec(entry['time_processed']))
+            rows = [(run_id, ALL_PREDICATES, int(entry['size']), int(entry['valid_answer']),
+                     int(entry['correct_answer']))]
+            if grouped is not None and entry['question_type'] in grouped.index:
+                predicate_row = grouped.loc[entry['question_type']]
+                for size_column in predicate_row.index[predicate_row.index.str.endswith('_size')]:
+                    predicate = size_column[:-len('_size')]
+                    if pd.isna(predicate_row[size_column]):
+                        continue
+                    rows.append((run_id, predicate, int(predicate_row[size_column]),
+                                 int(predicate_row[f'{predicate}_valid_answer']),
+                                 int(predicate_row[f'{predicate}_correct_answer'])))
+            conn.executemany('INSERT INTO predicate_results (run_id, predicate, size, valid_answer, correct_answer) '
+                             'VALUES (?, ?, ?, ?, ?)', rows)
+            run_ids.append(run_id)
+    return run_ids
+
+
+def query(conn, sql, params=()):
+    return pd.read_sql_query(sql, conn, params=params)
+
+
+def get_runs(conn, **filters):
+    """
+    :param filters: Optional equality filters on dataset, version, model, question_type or sampled
+    :return: DataFrame of the runs with their overall size, valid_answer, correct_answer and correct_percentage,
+    which is weighted for sampled runs
+    """
+    where, params = build_where(filters, table='r')
+    return query(conn, 'SELECT r.run_id, r.dataset, r.version, r.model, r.question_type, r.sampled, '
+                       'r.time_processed, p.size, p.valid_answer, p.correct_answer, '
+                       f'{CORRECT_PERCENTAGE} AS correct_percentage '
+                       'FROM runs r JOIN predicate_results p ON p.run_id = r.run_id AND p.predicate = ? '
+                       f'{where} ORDER BY r.dataset, r.model, r.question_type, r.version',
+                 (ALL_PREDICATES, *params))
+
+
+def compare_versions(conn, version_from, version_to, *, dataset=None, model=None, question_type=None):
+    """
+    Compares the correct_percentage of every question type and predicate between two versions.
+
+    :return: DataFrame with the percentages of both versions and their difference
+    """
+    return compare_runs(conn, 'version', version_from, version_to,
+                        dataset=dataset, model=model, question_type=question_type)
+
+
+def compare_models(conn, model_from, model_to, *, dataset=None, version=None, question_type=None):
+    """
+    Compares the correct_percentage of every question type and predicate between two models.
+    """
+    return compare_runs(conn, 'model', model_from, model_to,
+                        dataset=dataset, version=version, question_type=question_type)
+
+
+def compare_runs(conn, column, value_from, value_to, **filters):
+    filters = {key: value for key, value in filters.items() if value is not None}
+    key_columns = [key for key in ['dataset', 'model', 'version', 'question_type', 'sampled'] if key != column]
+    where_from, params_from = build_where({**filters, column: value_from}, table='a')
+    where_to, params_to = build_where({**filters, column: value_to}, table='a')
+    join_on = ' AND '.join(f'ra.{key} = rb.{key}' for key in key_columns)
+
+    return query(conn, f'''
+        WITH a AS (SELECT r.*, p.predicate, p.size, {CORRECT_PERCENTAGE} AS correct_percentage
+                   FROM runs r JOIN predicate_results p ON p.run_id = r.run_id)
+        SELECT {', '.join(f'ra.{key}' for key in key_columns)}, ra.predicate,
+               ra.size AS size_from, rb.size AS size_to,
+               ra.correct_percentage AS correct_percentage_from, rb.correct_percentage AS correct_percentage_to,
+               rb.correct_percentage - ra.correct_percentage AS difference
+        FROM (SELECT * FROM a {where_from}) ra
+        JOIN (SELECT * FROM a {where_to}) rb ON {join_on} AND ra.predicate = rb.predicate
+        ORDER BY difference''', (*params_from, *params_to))
+
+
+def regressed_predicates(conn, version_from, version_to, *, threshold=0.0, **filters):
+    """
+    Answers questions like 'which predicates regressed from v2 to v3?'.
+
+    :param threshold: minimal decrease of the correct_percentage
+    :return: DataFrame of the question types and predicates whose correct_percentage decreased
+    """
+    comparison = compare_versions(conn, version_from, version_to, **filters)
+    return comparison[(comparison['predicate'] != ALL_PREDICATES) & (comparison['difference'] < -threshold)]
+
+
+def get_questions(conn, run_id, *, predicate=None, correct_answer=None):
+    """
+    :return: DataFrame of the per question rows of a run, optionally filtered by predicate and correctness
+    """
+    filters = {'run_id': run_id, 'predicate': predicate, 'correct_answer': correct_answer}
+    where, params = build_where({key: value for key, value in filters.items() if value is not None})
+    return query(conn, f'SELECT * FROM questions {where} ORDER BY row_index', params)
+
+
+def build_where(filters, table=None):
+    prefix = f'{table}.' if table else ''
+    conditions = [f'{prefix}{key} = ?' for key in filters]
+    if not conditions:
+        return '', []
+    return 'WHERE ' + ' AND '.join(conditions), list(filters.values())
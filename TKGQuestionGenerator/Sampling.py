@@ -0,0 +1,189 @@
+import numpy as np
+import pandas as pd
+
+import TKGQuestionGenerator.HelperUtils as helper
+
+SAMPLE_WEIGHT = 'sample_weight'
+QUESTION_TYPE = 'question_type'
+
+
+def allocate(stratum_sizes, budget, min_per_stratum=1):
+    """
+    Distributes a budget over strata proportionally to their size (largest remainder method).
+    Every stratum gets at least min_per_stratum units if the budget allows it, no stratum gets more units than it has.
+
+    :param stratum_sizes: pd.Series stratum -> number of units
+    :param budget: total number of units to draw
+    :param min_per_stratum: minimal number of units per stratum
+    :return: pd.Series stratum -> number of units to draw
+    """
+    sizes = stratum_sizes.to_numpy(dtype=np.int64)
+    budget = int(min(budget, sizes.sum()))
+    base = np.minimum(sizes, min_per_stratum)
+
+    if base.sum() >= budget:
+        # not enough budget for the minimum of every stratum, the largest strata are preferred
+        allocation = np.zeros(len(sizes), dtype=np.int64)
+        for position in np.argsort(-sizes, kind='stable'):
+            if budget <= 0:
+                break
+            allocation[position] = min(base[position], budget)
+            budget -= allocation[position]
+        return pd.Series(allocation, index=stratum_sizes.index)
+
+    capacity = sizes - base
+    quota = capacity * (budget - base.sum()) / capacity.sum()
+    allocation = np.floor(quota).astype(np.int64)
+    leftover = budget - base.sum() - allocation.sum()
+    for position in np.argsort(-(quota - allocation), kind='stable')[:leftover]:
+        allocation[position] += 1
+    return pd.Series(base + allocation, index=stratum_sizes.index)
+
+
+def stratified_sample(df, budget, *, by=('predicate',), group_column=None, min_per_stratum=1, random_state=None):
+    """
+    Draws a stratified random sample of questions.
+
+    Every drawn question gets a SAMPLE_WEIGHT (size of its stratum / drawn units of its stratum), so
+    ResultEvaluator.get_results estimates the correct_percentage of the complete question set.
+
+    :param df: DataFrame of questions, e.g. from Generator.generate_questions
+    :param budget: number of units to draw
+    :param by: columns defining the strata
+    :param group_column: Optional column whose groups are drawn as a whole, e.g. qe_index for yes_no_robust
+    questions. The budget is then counted in groups.
+    :param min_per_stratum: minimal number of units per stratum
+    :param random_state: seed of the random generator
+    :return: sampled DataFrame with an additional SAMPLE_WEIGHT column
+    """
+    by = list(by)
+    rng = np.random.default_rng(random_state)
+
+    if group_column:
+        units = df.drop_duplicates(group_column)[[*by, group_column]]
+    else:
+        units = df[by]
+
+    allocation = allocate(units.groupby(by, sort=True).size(), budget, min_per_stratum)
+
+    drawn = []
+    weights = []
+    # groupby with sort=True iterates the strata in the order of the allocation
+    for (_, entry), n in zip(units.groupby(by, sort=True), allocation):
+        if n == 0:
+            continue
+        positions = rng.choice(len(entry), size=n, replace=False)
+        drawn.append(entry.index[np.sort(positions)])
+        weights.append(np.full(n, len(entry) / n))
+
+    if not drawn:
+        return df.iloc[:0].assign(**{SAMPLE_WEIGHT: pd.Series(dtype=float)})
+
+    drawn_units = pd.Series(np.concatenate(weights), index=drawn[0].append(drawn[1:]))
+    if group_column:
+        unit_weights = pd.Series(drawn_units.to_numpy(), index=units.loc[drawn_units.index, group_column])
+        sample = df[df[group_column].isin(unit_weights.index)].copy()
+        sample[SAMPLE_WEIGHT] = sample[group_column].map(unit_weights)
+    else:
+        sample = df.loc[drawn_units.index].copy()
+        sample[SAMPLE_WEIGHT] = drawn_units.to_numpy()
+    return sample
+
+
+def sample_questions(question_dfs, budget, *, by=('predicate',), group_columns=None, min_per_stratum=1,
+                     random_state=None):
+    """
+    Draws one stratified sample over several question types, stratified by question type and predicate.
+
+    :param question_dfs: dict question type -> DataFrame of questions
+    :param budget: total number of units to draw over all question types
+    :param by: columns defining the strata within a question type
+    :param group_columns: Optional dict question type -> group column, e.g. {'yes_no_robust': 'qe_index'}
+    :param min_per_stratum: minimal number of units per stratum
+    :param random_state: seed of the random generator
+    :return: dict question type -> sampled DataFrame
+    """
+    group_columns = group_columns or {}
+    by = list(by)
+
+    stratum_sizes = []
+    for question_type, df in question_dfs.items():
+        group_column = group_columns.get(question_type)
+        units = df.drop_duplicates(group_column) if group_column else df
+        stratum_sizes.append(units.groupby(by, sort=True).size().rename(question_type))
+    stratum_sizes = pd.concat(stratum_sizes, keys=list(question_dfs.keys()), names=[QUESTION_TYPE])
+
+    allocation = allocate(stratum_sizes, budget, min_per_stratum)
+
+    samples = {}
+    for i, (question_type, df) in enumerate(question_dfs.items()):
+        samples[question_type] = stratified_sample(df, allocation.loc[question_type].sum(), by=by,
+                                                   group_column=group_columns.get(question_type),
+                                                   min_per_stratum=min_per_stratum,
+                                                   random_state=None if random_state is None else random_state + i)
+    return samples
+
+
+def sample_fact_rows(fact_table, question_types, budget, *, rows=None, min_per_stratum=1, random_state=None):
+    """
+    Draws the facts the generation formulates questions of, stratified by question type and predicate, so a sampled
+    run never formulates the questions it would discard. The budget is counted in facts over all question types;
+    a fact yields about one question per question type, respectively one group of questions for yes_no_robust
+    (see group_column of stratified_sample).
+
+    :param fact_table: FactTable
+    :param question_types: question types to sample for
+    :param budget: total number of facts to draw over all question types
+    :param rows: Optional positional rows to sample from, defaults to all rows
+    :param min_per_stratum: minimal number of facts per stratum
+    :param random_state: seed of the random generator
+    :return: dict question type -> sorted array of positional rows and dict (question type, predicate) ->
+    SAMPLE_WEIGHT of the questions of that stratum
+    """
+    rows = np.arange(len(fact_table)) if rows is None else np.asarray(rows)
+    facts = pd.DataFrame({'predicate': fact_table.predicate[rows]}, index=rows)
+    samples = sample_questions({question_type: facts for question_type in question_types}, budget,
+                               min_per_stratum=min_per_stratum, random_state=random_state)
+
+    sampled_rows = {}
+    weights = {}
+    for question_type, sample in samples.items():
+        sampled_rows[question_type] = np.sort(sample.index.to_numpy())
+        for code, weight in zip(sample['predicate'], sample[SAMPLE_WEIGHT]):
+            weights[(question_type, fact_table.predicates[code])] = weight
+    return sampled_rows, weights
+
+
+def budget_for_time(time_budget_sec, sec_per_100_qe):
+    """
+    Number of questions a model can answer within the time budget. Inverse of
+    HelperUtils.estimated_model_time_consumption.
+    """
+    return int(time_budget_sec / sec_per_100_qe * 100)
+
+
+def facts_for_questions(n_questions, questions_per_fact):
+    """
+    Number of facts sample_fact_rows has to draw for about n_questions questions. sample_fact_rows spreads its budget
+    evenly over the question types, whose facts yield different numbers of questions, e.g. about 12 for
+    yes_no_robust and 1 for when.
+
+    :param n_questions: e.g. of budget_for_time
+    :param questions_per_fact: dict question type -> mean number of questions per fact
+    """
+    questions_per_fact_type = sum(questions_per_fact.values()) / max(len(questions_per_fact), 1)
+    return int(n_questions / max(questions_per_fact_type, 1e-9))
+
+
+def sec_per_100_qe_from_results(results_df, question_type=None):
+    """
+    Measured throughput of previous runs, e.g. of results/YAGO11k_ALL_V3_RESULTS.csv.
+
+    :param results_df: DataFrame with the columns question_type, size and time_processed
+    :param question_type: Optional question type, if None the throughput over all rows is returned
+    :return: seconds the model needed per 100 questions
+    """
+    if question_type:
+        results_df = results_df[results_df[QUESTION_TYPE] == question_type]
+    seconds = sum(helper.min_sec_to_sec(time_processed) for time_processed in results_df['time_processed'])
+    return seconds / results_df['size'].sum() * 100
@@ -0,0 +1,192 @@
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import TKGQuestionGenerator.Export as export
+import TKGQuestionGenerator.Generator as generator
+
+logger = logging.getLogger(__name__)
+
+WARM_UP_FACT = ('Barack Obama', 'was president of', 'United States', 2009, 2017)
+
+
+class MicroBatcher:
+    """
+    Collects requests of many client threads and hands them to process_batch in batches.
+
+    A batch is closed as soon as it holds max_batch_size requests or max_wait seconds passed since its first
+    request, so a single request waits at most max_wait while bursts are processed together.
+    """
+
+    def __init__(self, process_batch, *, max_batch_size=64, max_wait=0.001):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._requests = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='micro-batcher')
+        self._thread.start()
+
+    def submit(self, request, timeout=None):
+        """
+        :return: result of process_batch for request, exceptions of the request are raised
+        """
+        return self.submit_async(request).result(timeout)
+
+    def submit_async(self, request):
+        """
+        Enqueues a request without waiting for it, so several requests of one client end up in the same batch.
+
+        :return: Future of the result of process_batch for request
+        """
+        future = Future()
+        self._requests.put((request, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._requests.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    batch.append(self._requests.get(timeout=remaining) if remaining > 0
+                                 else self._requests.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                results = self.process_batch([request for request, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            for (_, future), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+
+def formulate_batch(requests):
+    """
+    Formulates the questions of a batch of requests, identical requests are formulated once.
+
+    :param requests: list of dicts with question_type, fact [subject, predicate, object, from, until] and optional
+    kwargs of the formulate function
+    :return: list of question lists (see Generator.formulate_questions) or the exception of the request
+    """
+    results = {}
+    for request in requests:
+        key = json.dumps(request, sort_keys=True)
+        if key in results:
+            continue
+        try:
+            question_type = request['question_type']
+            if question_type not in generator.QUESTION_TYPES:
+                raise ValueError(f'Unknown question type {question_type}, expected one of '
+                                 f'{", ".join(generator.QUESTION_TYPES)}')
+            subject, predicate, object, time_from, time_until = request['fact']
+            results[key] = generator.formulate_questions(question_type, subject, predicate, object, time_from,
+                                                         time_until, **request.get('kwargs', {}))
+        except Exception as e:
+            results[key] = e
+    return [results[json.dumps(request, sort_keys=True)] for request in requests]
+
+
+def warm_up(predicates=()):
+    """
+    Runs every question type once, so the spaCy pipeline and the code paths are warm before the first request,
+    and fills the predicate cache of Generator.lemma_predicate with the given predicates.
+
+    :param predicates: e.g. FactTable.predicates of the TKG that will be served
+    """
+    subject, predicate, object, time_from, time_until = WARM_UP_FACT
+    for question_type in generator.QUESTION_TYPES:
+        try:
+            generator.formulate_questions(question_type, subject, predicate, object, time_from, time_until)
+        except Exception:
+            logger.exception('Warm-up of question type %s failed', question_type)
+    for predicate in predicates:
+        for lemma in (True, False):
+            generator.lemma_predicate(str(predicate), lemma)
+
+
+class GenerationRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /generate with a JSON body
+    {"question_type": "when", "fact": ["Barack Obama", "was president of", "United States", 2009, 2017],
+     "kwargs": {"predicate_question_dict": {...}}}
+    answers {"questions": [[question, answer], ...]}. A list of such requests is answered with a list of results.
+
+    GET /health answers {"status": "ok", "question_types": [...]}.
+    """
+    protocol_version = 'HTTP/1.1'
+    # small keep-alive responses would otherwise wait for the delayed ACK of the client
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.path != '/health':
+            self.send_json(404, {'error': f'Unknown path {self.path}'})
+            return
+        self.send_json(200, {'status': 'ok', 'question_types': list(generator.QUESTION_TYPES)})
+
+    def do_POST(self):
+        if self.path != '/generate':
+            self.send_json(404, {'error': f'Unknown path {self.path}'})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError as e:
+            self.send_json(400, {'error': f'Invalid JSON: {e}'})
+            return
+
+        requests = body if isinstance(body, list) else [body]
+        # all items are enqueued before waiting, so the items of a list are formulated in the same batches
+        futures = [self.server.batcher.submit_async(request) for request in requests]
+        results = []
+        for future in futures:
+            try:
+                results.append({'questions': future.result()})
+            except Exception as e:
+                results.append({'error': f'{type(e).__name__}: {e}'})
+        status = 200 if isinstance(body, list) or 'error' not in results[0] else 400
+        self.send_json(status, results if isinstance(body, list) else results[0])
+
+    def send_json(self, status, value):
+        data = json.dumps(value, ensure_ascii=False, default=export.to_json_value).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class GenerationServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, *, max_batch_size=64, max_wait=0.001):
+        super().__init__(address, GenerationRequestHandler)
+        self.batcher = MicroBatcher(formulate_batch, max_batch_size=max_batch_size, max_wait=max_wait)
+
+
+def serve(host='127.0.0.1', port=8765, *, predicates=(), max_batch_size=64, max_wait=0.001):
+    """
+    Runs a long-lived question generation service that keeps the spaCy pipeline, the question type registry and
+    the predicate cache warm, so single facts are turned into questions without the start-up cost of a batch run.
+    Requests of concurrent clients are micro-batched, see MicroBatcher.
+
+    Binds to localhost by default, the service has no authentication.
+
+    :param predicates: predicates to pre-cache, e.g. FactTable.predicates
+    :param max_batch_size: maximum number of requests per batch
+    :param max_wait: seconds a batch waits for further requests
+    """
+    warm_up(predicates)
+    with GenerationServer((host, port), max_batch_size=max_batch_size, max_wait=max_wait) as server:
+        logger.info('Serving question generation on http://%s:%d', *server.server_address[:2])
+        server.serve_forever()
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import TKGQuestionGenerator.BinaryStore as store
+
+TOKEN_DTYPE = np.int32
+
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    """
+    Fingerprints everything that influences the token ids of a tokenizer: its class, its serialised definition
+    (vocabulary, normalisation, pre-tokenisation and post-processing) and its special tokens.
+
+    :return: 16 hex digit fingerprint
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(type(tokenizer).__name__.encode('utf-8'))
+    backend_tokenizer = getattr(tokenizer, 'backend_tokenizer', None)
+    if backend_tokenizer is not None:
+        digest.update(backend_tokenizer.to_str().encode('utf-8'))
+    else:
+        digest.update(json.dumps(sorted(tokenizer.get_vocab().items())).encode('utf-8'))
+    digest.update(json.dumps(tokenizer.special_tokens_map, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def tokenize_questions(questions, tokenizer, *, batch_size=1024):
+    """
+    Tokenizes questions in batches into a flat buffer.
+
+    :param questions: list of questions
+    :param tokenizer: tokenizer of the model
+    :param batch_size: number of questions passed to the tokenizer at once
+    :return: flat int32 array of all token ids, int64 offsets (len(questions) + 1) and int32 lengths
+    """
+    lengths = np.zeros(len(questions), dtype=np.int32)
+    chunks = []
+    for start in range(0, len(questions), batch_size):
+        input_ids = tokenizer(list(questions[start:start + batch_size]))['input_ids']
+        lengths[start:start + len(input_ids)] = [len(ids) for ids in input_ids]
+        chunks.append(np.fromiter((token for ids in input_ids for token in ids), dtype=TOKEN_DTYPE))
+
+    offsets = np.zeros(len(questions) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    token_ids = np.concatenate(chunks) if chunks else np.zeros(0, dtype=TOKEN_DTYPE)
+    return token_ids, offsets, lengths
+
+
+def token_cache_path(question_store_path, fingerprint):
+    return f'{question_store_path}.tokens-{fingerprint}'
+
+
+def build_token_cache(question_store_path, tokenizer, *, batch_size=1024):
+    """
+    Tokenizes all questions of a question store (see BinaryStore.save_questions) once and stores the token ids
+    next to it, keyed by the tokenizer fingerprint.
+
+    :return: path of the token cache
+    """
+    fingerprint = tokenizer_fingerprint(tokenizer)
+    with store.BinaryStore(question_store_path) as question_store:
+        questions = question_store.strings('qe')
+    token_ids, offsets, lengths = tokenize_questions(questions, tokenizer, batch_size=batch_size)
+
+    path = token_cache_path(question_store_path, fingerprint)
+    store.write_store(path, {'token_ids': token_ids, 'offsets': offsets, 'lengths': lengths},
+                      attributes={'type': 'tokens', 'tokenizer': fingerprint, 'questions': len(questions),
+                                  'pad_token_id': tokenizer.pad_token_id})
+    return path
+
+
+def load_token_cache(question_store_path, tokenizer, *, build=True):
+    """
+    Opens the token cache of a question store for the given tokenizer. The arrays are memory-mapped.
+
+    :param build: builds the token cache if it does not exist yet
+    :return: TokenCache or None if it does not exist and build is False
+    """
+    path = token_cache_path(question_store_path, tokenizer_fingerprint(tokenizer))
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(question_store_path):
+        if not build:
+            return None
+        build_token_cache(question_store_path, tokenizer)
+    return TokenCache(store.BinaryStore(path))
+
+
+class TokenCache:
+    """
+    Token ids of the questions of a question store as flat int32 buffer plus offsets and lengths.
+    """
+
+    def __init__(self, token_store):
+        self.store = token_store
+        self.token_ids = token_store.array('token_ids')
+        self.offsets = token_store.array('offsets')
+        self.lengths = token_store.array('lengths')
+        self.pad_token_id = token_store.attributes['pad_token_id']
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def token_ids_of(self, row):
+        return self.token_ids[self.offsets[row]:self.offsets[row + 1]]
+
+    def padded_batch(self, rows):
+        """
+        :return: padded input ids and attention mask of the given rows as int64 numpy arrays
+        """
+        rows = np.asarray(rows)
+        max_length = int(self.lengths[rows].max(initial=0))
+        input_ids = np.full((len(rows), max_length), self.pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros((len(rows), max_length), dtype=np.int64)
+        for i, row in enumerate(rows):
+            length = self.lengths[row]
+            input_ids[i, :length] = self.token_ids_of(row)
+            attention_mask[i, :length] = 1
+        return input_ids, attention_mask
+
+    def length_buckets(self, batch_size, rows=None):
+        """
+        Groups rows of similar length into batches, so little padding is computed.
+
+        :return: list of arrays of rows
+        """
+        if rows is None:
+            rows = np.arange(len(self))
+        rows = np.asarray(rows)
+        ordered = rows[np.argsort(self.lengths[rows], kind='stable')]
+        return [ordered[start:start + batch_size] for start in range(0, len(ordered), batch_size)]
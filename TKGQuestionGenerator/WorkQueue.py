@@ -0,0 +1,300 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import socket
+import time
+import uuid
+
+import numpy as np
+
+import TKGQuestionGenerator.BinaryStore as store
+import TKGQuestionGenerator.HelperUtils as helper
+import TKGQuestionGenerator.TokenCache as tokens
+
+logger = logging.getLogger(__name__)
+
+QUEUE_NAME = 'queue.json'
+QUESTIONS_NAME = 'questions.qst'
+LEASE_DIR = 'leases'
+ANSWER_DIR = 'answers'
+
+
+def create_queue(question_store_path, work_dir, *, chunk_size=1000, overwrite=False):
+    """
+    Splits a question store (see BinaryStore.save_questions) into chunks that workers pull from a shared
+    directory, e.g. a network file system mounted on every machine.
+
+    Layout of work_dir:
+    - queue.json: question type, fingerprint of the question store and row range of every chunk
+    - questions.qst: copy of the question store, workers memory-map only the rows of their chunk
+    - leases/{chunk}.{generation}: lease files of the chunks being answered
+    - answers/{chunk}.qst: answered chunks, see ResultEvaluator.merge_answer_chunks
+
+    :param chunk_size: number of questions per chunk
+    :param overwrite: if True the queue, leases, answers and token caches of a previous queue in work_dir are
+    removed, otherwise a work_dir that is not empty is refused
+    :return: number of chunks
+    """
+    if os.path.isdir(work_dir) and os.listdir(work_dir):
+        if not overwrite:
+            raise FileExistsError(f'{work_dir} is not empty, pass overwrite=True to replace the previous queue')
+        clear_queue(work_dir, keep=question_store_path)
+    os.makedirs(os.path.join(work_dir, LEASE_DIR), exist_ok=True)
+    os.makedirs(os.path.join(work_dir, ANSWER_DIR), exist_ok=True)
+    queue_questions_path = questions_path(work_dir)
+    if os.path.abspath(question_store_path) != os.path.abspath(queue_questions_path):
+        shutil.copyfile(question_store_path, queue_questions_path)
+
+    with store.BinaryStore(queue_questions_path) as question_store:
+        question_type = question_store.attributes['question_type']
+        n_questions = question_store.columns['qe']['length']
+    chunks = [[start, min(start + chunk_size, n_questions)] for start in range(0, n_questions, chunk_size)]
+    write_json(os.path.join(work_dir, QUEUE_NAME), {'question_type': question_type,
+                                                    'fingerprint': file_fingerprint(queue_questions_path),
+                                                    'chunks': chunks})
+    return len(chunks)
+
+
+def clear_queue(work_dir, keep=None):
+    """
+    Removes the files of a queue from work_dir. Other files are kept.
+
+    :param keep: Optional path that is not removed, e.g. the question store a new queue is created from
+    """
+    for directory in [LEASE_DIR, ANSWER_DIR]:
+        shutil.rmtree(os.path.join(work_dir, directory), ignore_errors=True)
+    for path in [os.path.join(work_dir, QUEUE_NAME), *glob.glob(f'{glob.escape(questions_path(work_dir))}*')]:
+        if keep is None or os.path.abspath(path) != os.path.abspath(keep):
+            os.remove(path)
+
+
+def file_fingerprint(path):
+    """
+    :return: 16 hex digit fingerprint of the content of a file
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(2 ** 20), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def questions_path(work_dir):
+    return os.path.join(work_dir, QUESTIONS_NAME)
+
+
+def load_token_cache(work_dir, tokenizer):
+    """
+    Opens the token cache of the questions of a queue, see TokenCache.load_token_cache. The first worker builds it,
+    concurrent builds are safe since every store is written to a temporary file and renamed.
+    """
+    return tokens.load_token_cache(questions_path(work_dir), tokenizer)
+
+
+def load_queue(work_dir):
+    with open(os.path.join(work_dir, QUEUE_NAME), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_json(path, value):
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+
+def answer_path(work_dir, chunk):
+    return os.path.join(work_dir, ANSWER_DIR, f'{chunk:06d}.qst')
+
+
+def lease_path(work_dir, chunk, generation):
+    return os.path.join(work_dir, LEASE_DIR, f'{chunk:06d}.{generation}')
+
+
+def latest_leases(work_dir):
+    """
+    :return: dict chunk -> highest lease generation
+    """
+    leases = {}
+    for name in os.listdir(os.path.join(work_dir, LEASE_DIR)):
+        chunk, _, generation = name.partition('.')
+        if generation.isdigit():
+            leases[int(chunk)] = max(leases.get(int(chunk), 0), int(generation))
+    return leases
+
+
+def is_expired(path, lease_timeout):
+    try:
+        return time.time() - os.stat(path).st_mtime > lease_timeout
+    except FileNotFoundError:
+        return True
+
+
+class Lease:
+    """
+    Exclusive lease of a chunk. Every (re-)lease creates the next generation of the lease file with O_EXCL, so only
+    one worker can take over a chunk, and a worker whose lease was taken over notices the newer generation.
+    The lease is kept alive by touching its file whenever the worker made progress, see run_worker.
+    """
+
+    def __init__(self, work_dir, chunk, generation, worker_id):
+        self.work_dir = work_dir
+        self.chunk = chunk
+        self.generation = generation
+        self.worker_id = worker_id
+        self.path = lease_path(work_dir, chunk, generation)
+
+    @classmethod
+    def try_acquire(cls, work_dir, chunk, generation, worker_id):
+        """
+        :return: Lease or None if another worker created this generation first
+        """
+        path = lease_path(work_dir, chunk, generation)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return None
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'worker': worker_id, 'acquired': time.time()}, f)
+        for previous in range(generation):
+            try:
+                os.remove(lease_path(work_dir, chunk, previous))
+            except FileNotFoundError:
+                pass
+        return cls(work_dir, chunk, generation, worker_id)
+
+    def is_current(self):
+        return os.path.exists(self.path) and not os.path.exists(lease_path(self.work_dir, self.chunk,
+                                                                           self.generation + 1))
+
+    def renew(self):
+        """
+        :return: False if the lease was taken over by another worker
+        """
+        if not self.is_current():
+            return False
+        try:
+            os.utime(self.path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def release(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def acquire_next_chunk(work_dir, worker_id, *, lease_timeout):
+    """
+    Leases the first chunk that has no answers yet and was never leased. If every such chunk is leased, the first
+    chunk whose lease expired, i.e. whose worker crashed or stalled, is leased again. Never leased chunks come first,
+    so a slow worker is not overtaken while there is other work left.
+
+    :return: (Lease, unfinished chunks) whereby Lease is None if no chunk is available right now
+    """
+    queue = load_queue(work_dir)
+    leases = latest_leases(work_dir)
+    unfinished = [chunk for chunk in range(len(queue['chunks'])) if not os.path.exists(answer_path(work_dir, chunk))]
+    never_leased = [chunk for chunk in unfinished if chunk not in leases]
+    for chunk in never_leased + [chunk for chunk in unfinished if chunk in leases]:
+        generation = leases.get(chunk)
+        if generation is not None and not is_expired(lease_path(work_dir, chunk, generation), lease_timeout):
+            continue
+        next_generation = 0 if generation is None else generation + 1
+        if generation is not None:
+            logger.info('Re-leasing chunk %d after its lease expired', chunk)
+        lease = Lease.try_acquire(work_dir, chunk, next_generation, worker_id)
+        if lease is not None:
+            return lease, unfinished
+    return None, unfinished
+
+
+def run_worker(work_dir, answer_function, *, token_cache=None, token_answer_function=None, worker_id=None,
+               lease_timeout=300, batch_size=100, poll_interval=5):
+    """
+    Answers chunks of a queue (see create_queue) until every chunk is answered. Several workers on several machines
+    may run on the same work_dir.
+
+    A chunk is answered in batches of batch_size questions and the lease is renewed after every batch, so only a
+    worker that makes progress keeps its lease. Chunks whose lease was not renewed for lease_timeout seconds, since
+    their worker crashed or got stuck, are leased again by the next free worker. lease_timeout must therefore exceed
+    the time of one batch, a warning is logged otherwise. A worker whose lease was taken over discards its answers of
+    the chunk. The lease timeout
+    compares the modification time of the lease file with the local clock, hence the clocks of the machines must be
+    roughly in sync.
+
+    :param answer_function: function answering a list of questions, see Inference.make_answer_function
+    :param token_cache: Optional TokenCache of the questions of the queue, see load_token_cache
+    :param token_answer_function: Optional function answering rows of token_cache, see
+    Inference.make_token_answer_function. Used instead of answer_function if token_cache is given, so the questions
+    are not tokenized again.
+    :param worker_id: Optional name of the worker, defaults to host and process id
+    :param lease_timeout: seconds after which a lease counts as expired
+    :param batch_size: number of questions answered between two renewals of the lease
+    :param poll_interval: seconds to wait if all unfinished chunks are leased by other workers
+    :return: list of the chunks answered by this worker
+    """
+    worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+    queue = load_queue(work_dir)
+    question_type = queue['question_type']
+    questions = store.BinaryStore(questions_path(work_dir))
+
+    answered = []
+    warned = False
+    while True:
+        lease, unfinished = acquire_next_chunk(work_dir, worker_id, lease_timeout=lease_timeout)
+        if lease is None:
+            if not unfinished:
+                return answered
+            time.sleep(poll_interval)
+            continue
+
+        start, stop = queue['chunks'][lease.chunk]
+        df = store.read_questions(questions, start, stop)
+        time_start = time.time()
+        chunk_questions = df[f'{question_type}_qe'].tolist()
+        model_answers = []
+        for position in range(0, stop - start, batch_size):
+            batch_start = time.time()
+            if token_cache is not None and token_answer_function is not None:
+                rows = np.arange(start + position, min(start + position + batch_size, stop))
+                model_answers.extend(token_answer_function(token_cache, rows))
+            else:
+                model_answers.extend(answer_function(chunk_questions[position:position + batch_size]))
+            batch_seconds = time.time() - batch_start
+            if batch_seconds >= lease_timeout and not warned:
+                logger.warning('Answering a batch took %.1f sec, more than the lease timeout of %.1f sec, hence other '
+                               'workers take over the chunks of this worker. Increase the lease timeout or decrease '
+                               'the batch size.', batch_seconds, lease_timeout)
+                warned = True
+            if not lease.renew():
+                break
+
+        if not lease.is_current():
+            logger.warning('Discarding the answers of chunk %d, it was leased by another worker', lease.chunk)
+            continue
+        df[f'{question_type}_model_an'] = model_answers
+        df[f'{question_type}_time'] = time.time() - time_start
+        confidences = helper.answer_confidences(model_answers)
+        if confidences is not None:
+            df[f'{question_type}_confidence'] = confidences
+        store.save_questions(df, question_type, answer_path(work_dir, lease.chunk),
+                             attributes={'fingerprint': queue['fingerprint'], 'chunk': lease.chunk})
+        lease.release()
+        answered.append(lease.chunk)
+        logger.info('Worker %s answered chunk %d', worker_id, lease.chunk)
+
+
+def progress(work_dir):
+    """
+    :return: dict with the number of chunks, answered chunks and chunks leased right now
+    """
+    queue = load_queue(work_dir)
+    answered = sum(os.path.exists(answer_path(work_dir, chunk)) for chunk in range(len(queue['chunks'])))
+    leased = sum(not os.path.exists(answer_path(work_dir, chunk)) for chunk in latest_leases(work_dir))
+    return {'chunks': len(queue['chunks']), 'answered': answered, 'leased': leased}
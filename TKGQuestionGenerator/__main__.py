@@ -0,0 +1,92 @@
+import argparse
+import logging
+
+import TKGQuestionGenerator.BinaryStore as store
+import TKGQuestionGenerator.Pipeline as pipeline
+import TKGQuestionGenerator.Service as service
+import TKGQuestionGenerator.WorkQueue as work_queue
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m TKGQuestionGenerator',
+                                     description='Generates temporal questions from a TKG, answers them with a '
+                                                 'text2text-generation model, evaluates the answers and renders a '
+                                                 'report.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='runs generate -> infer -> evaluate -> report')
+    run_parser.add_argument('config', help='path of the JSON config, see Pipeline.load_config')
+    run_parser.add_argument('--limit', type=int, default=None, help='only uses the first LIMIT facts')
+    run_parser.add_argument('--budget', type=int, default=None,
+                            help='samples BUDGET facts stratified by question type and predicate')
+    run_parser.add_argument('--time-budget', type=float, default=None,
+                            help='samples the facts whose questions the model answers in TIME_BUDGET seconds, requires '
+                                 'sec_per_100_qe or throughput_results in the config')
+    run_parser.add_argument('--adaptive-robust', action='store_true', default=None,
+                            help='stops asking the yes_no_robust questions of an entity after its first incorrect '
+                                 'answer')
+
+    queue_parser = subparsers.add_parser('queue', help='splits a question store into chunks for distributed workers')
+    queue_parser.add_argument('questions', help='path of a question store, see BinaryStore.save_questions')
+    queue_parser.add_argument('work_dir', help='shared directory of the queue')
+    queue_parser.add_argument('--chunk-size', type=int, default=1000, help='number of questions per chunk')
+    queue_parser.add_argument('--overwrite', action='store_true',
+                              help='replaces the queue, leases and answers of a previous queue in WORK_DIR')
+
+    worker_parser = subparsers.add_parser('worker', help='answers chunks of a queue until all chunks are answered')
+    worker_parser.add_argument('work_dir', help='shared directory of the queue')
+    worker_parser.add_argument('config', help='path of the JSON config with the model, see Pipeline.load_config')
+    worker_parser.add_argument('--lease-timeout', type=float, default=300,
+                               help='seconds after which the chunk of a worker without progress is leased again')
+    worker_parser.add_argument('--batch-size', type=int, default=100,
+                               help='number of questions answered between two renewals of the lease')
+
+    serve_parser = subparsers.add_parser('serve', help='serves question generation over HTTP for single facts')
+    serve_parser.add_argument('--host', default='127.0.0.1', help='address to bind to')
+    serve_parser.add_argument('--port', type=int, default=8765, help='port to bind to')
+    serve_parser.add_argument('--facts', default=None,
+                              help='fact store (see BinaryStore.save_fact_table) whose predicates are pre-cached')
+    serve_parser.add_argument('--max-wait', type=float, default=0.001,
+                              help='seconds a micro-batch waits for further requests')
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    if args.command == 'run':
+        config = pipeline.load_config(args.config)
+        if args.limit is not None:
+            config['limit'] = args.limit
+        if args.budget is not None:
+            config['budget'] = args.budget
+        if args.time_budget is not None:
+            config['time_budget'] = args.time_budget
+        if args.adaptive_robust is not None:
+            config['adaptive_robust'] = args.adaptive_robust
+        results_df, _ = pipeline.run_pipeline(config)
+        print(results_df.to_string(index=False))
+
+    elif args.command == 'queue':
+        n_chunks = work_queue.create_queue(args.questions, args.work_dir, chunk_size=args.chunk_size,
+                                           overwrite=args.overwrite)
+        print(f'{n_chunks} chunks in {args.work_dir}')
+
+    elif args.command == 'worker':
+        question_type = work_queue.load_queue(args.work_dir)['question_type']
+        config = pipeline.load_config(args.config)
+        backend = pipeline.load_backend(config)
+        answer_function, answer_functions = pipeline.load_answer_functions(config, backend)
+        # generated answers reuse the token ids of the questions, which are tokenized once per tokenizer
+        token_answer_function = pipeline.load_token_answer_function(config, question_type, backend)
+        token_cache = work_queue.load_token_cache(args.work_dir, backend[2]) if token_answer_function else None
+        answered = work_queue.run_worker(args.work_dir, answer_functions.get(question_type, answer_function),
+                                         token_cache=token_cache, token_answer_function=token_answer_function,
+                                         lease_timeout=args.lease_timeout, batch_size=args.batch_size)
+        print(f'Answered {len(answered)} chunks')
+
+    elif args.command == 'serve':
+        predicates = store.load_fact_table(args.facts).predicates if args.facts else ()
+        service.serve(args.host, args.port, predicates=predicates, max_wait=args.max_wait)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip('en_core_web_sm')
+
+import TKGQuestionGenerator.FactTable as ft  # noqa: E402
+import TKGQuestionGenerator.Incremental as incremental  # noqa: E402
+
+
+def make_facts(n):
+    return pd.DataFrame({ft.SUBJECT: [f'person {i}' for i in range(n)],
+                         ft.PREDICATE: ['graduated from'] * n,
+                         ft.OBJECT: [f'university {i}' for i in range(n)],
+                         ft.FROM: [1900 + i for i in range(n)],
+                         ft.UNTIL: [1904 + i for i in range(n)]})
+
+
+def test_apply_delta_remaps_qe_index_of_reindexed_facts():
+    facts = make_facts(100)
+    first, _, manifest = incremental.generate_incremental(ft.from_dataframe(facts), 'when', {'question_types': {}})
+
+    # a refresh prepends a fact and reindexes the CSV, so the new fact gets the index of a kept fact
+    refreshed = pd.concat([make_facts(101).iloc[[100]], facts], ignore_index=True)
+    fact_table = ft.from_dataframe(refreshed)
+    delta, deleted_keys, new_manifest = incremental.generate_incremental(fact_table, 'when', manifest)
+    assert len(delta) == 1
+    assert deleted_keys == []
+
+    merged = incremental.apply_delta(first, delta, deleted_keys, new_manifest['question_types']['when'])
+    assert len(merged) == 101
+    assert merged['qe_index'].nunique() == 101
+    subjects = merged['when_qe'].str.extract(r'(person \d+)')[0]
+    assert (refreshed.loc[merged['qe_index'], ft.SUBJECT].to_numpy() == subjects.to_numpy()).all()